@@ -1,12 +1,22 @@
+import argparse
+import hashlib
+import itertools
 import json
+import sys
 import os
-import math
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from typing import List
 from dotenv import load_dotenv
 import boto3
-import re
-from langchain import hub
+from botocore.config import Config
+from langchain_aws import ChatBedrock
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, "my_discord_bot"))
+from export_reader import iter_records, batched, HighWaterMark
+from bedrock_retry import call_with_backoff
 
 # Access the environment variables
 load_dotenv()
@@ -15,24 +25,22 @@ aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 aws_region = os.getenv("AWS_DEFAULT_REGION")
 discord_token = os.getenv("DISCORD_TOKEN")
 
+# Sized for the structuring calls running at once; adaptive mode also slows
+# the client down on its own when Bedrock starts throttling
 aws_client = boto3.client(
     "bedrock-runtime",
     region_name="us-west-2",
     aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key
+    aws_secret_access_key=aws_secret_key,
+    config=Config(max_pool_connections=32, retries={"mode": "adaptive", "max_attempts": 3}),
 )
 
 # Set file paths
-input_path = "/Users/dan/calpoly/BusinessAnalytics/GSB570GENAI/studyDropshipping/structured_output.json"
-output_path = "/Users/dan/calpoly/BusinessAnalytics/GSB570GENAI/studyDropshipping/qa_threads.json"
+input_path = os.path.join(here, "structured_output.json")
+output_path = os.path.join(here, "qa_threads.json")
 
-# Load the structured input data
-with open(input_path, "r", encoding="utf-8") as f:
-    structured = json.load(f)
-
-# Split into batches of 250 messages
+# Messages per grouping call
 batch_size = 250
-structured_batches = [structured[i:i+batch_size] for i in range(0, len(structured), batch_size)]
 
 # Utility functions for prompt construction
 def build_summary_prompt(batch: List[dict]) -> str:
@@ -127,55 +135,218 @@ model_kwargs =  {
 }
 
 # Instantiate the ChatBedrock wrapper
-from langchain_aws import ChatBedrock
 llm = ChatBedrock(
     client=aws_client,
     model_id=model_id,
     model_kwargs=model_kwargs,
 )
 
-# The hub provides sample templates for each agent type
-prompt = hub.pull("hwchase17/structured-chat-agent") # this is a template pre-tuned for building a structured chat agent
 
-structured_threads = []
-thread_id_counter = 1
+# --- Retries ---
+def log_retry(attempt, error):
+    print(f"{error.response['Error']['Code']}, retrying (attempt {attempt})")
 
-for batch_index, batch in enumerate(structured_batches):
-    print(f"Processing batch {batch_index + 1} of {len(structured_batches)}...")
 
-    # Step 1: Use Claude to group the batch into conversational threads
-    try:
-        summary_prompt = build_summary_prompt(batch)
-        response = llm.invoke(summary_prompt)
-    except Exception as e:
-        print(f"Error invoking Claude for batch {batch_index + 1}: {e}")
-        continue
+def invoke_with_backoff(prompt):
+    """llm.invoke, retrying Bedrock throttling with the shared jittered backoff in bedrock_retry.py"""
+    return call_with_backoff(llm.invoke, prompt, base_delay=1.0, max_delay=30.0, on_retry=log_retry)
 
-    # Step 2: Extract individual threads from Claude's output
-    thread_blocks = re.split(r"(?m)^\s*---\s*$", response.content)
-    thread_blocks = [block.strip() for block in thread_blocks if block.strip()]
 
-    print(f"Found {len(thread_blocks)} threads in batch {batch_index + 1}")
+# --- Checkpoints ---
+def checkpoint_path(checkpoint_dir, first_message, batch):
+    """One file per batch, keyed by its contents so an edited export is not resumed from stale results"""
+    digest = hashlib.sha1(json.dumps(batch, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(checkpoint_dir, f"batch_{first_message:07d}_{digest}.json")
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    # Step 3: Format each thread into the desired JSON structure
-    for thread_text in thread_blocks:
-        struct_prompt = build_structuring_prompt(thread_text, thread_id_counter)
-        try:
-            result = llm.invoke(struct_prompt)
-            qa = json.loads(result.content)
-            structured_threads.append(qa)
-            thread_id_counter += 1
-        except json.JSONDecodeError:
-            print(f"Could not parse JSON for thread {thread_id_counter}")
-        except Exception as e:
-            print(f"Error structuring thread {thread_id_counter}: {e}")
 
-# Step 4: Save all results to the output JSON file
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(structured_threads, f, indent=2, ensure_ascii=False)
+def save_checkpoint(path, threads):
+    """Writes to a temp file and renames it, so a crash never leaves half a checkpoint"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(threads, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
-print(f"Done. {len(structured_threads)} Q&A threads written to: {output_path}")
 
+# --- Pipeline ---
+def split_threads(text):
+    """Step 2: the individual threads in Claude's grouping output"""
+    thread_blocks = re.split(r"(?m)^\s*---\s*$", text)
+    return [block.strip() for block in thread_blocks if block.strip()]
 
 
+def structure_thread(thread_text, thread_number):
+    """Step 3: one thread as a JSON object, or None if Claude's output would not parse"""
+    try:
+        result = invoke_with_backoff(build_structuring_prompt(thread_text, thread_number))
+        return json.loads(result.content)
+    except json.JSONDecodeError:
+        print(f"Could not parse JSON for thread {thread_number}")
+    except Exception as e:
+        print(f"Error structuring thread {thread_number}: {e}")
+    return None
+
+
+def process_batch(batch_index, batch, thread_pool):
+    """
+    Groups one batch into threads and structures them on the shared thread pool
+
+    Return:
+        List[dict]: structured threads in the order Claude listed them, or None if grouping failed
+    """
+    # Step 1: Use Claude to group the batch into conversational threads
+    try:
+        response = invoke_with_backoff(build_summary_prompt(batch))
+    except Exception as e:
+        print(f"Error invoking Claude for batch {batch_index + 1}: {e}")
+        return None
+
+    thread_blocks = split_threads(response.content)
+    print(f"Found {len(thread_blocks)} threads in batch {batch_index + 1}")
 
+    # Numbers in the prompt are provisional; final ids are assigned in batch order once all batches are done
+    futures = [
+        thread_pool.submit(structure_thread, thread_text, batch_index * 1000 + position + 1)
+        for position, thread_text in enumerate(thread_blocks)
+    ]
+    return [qa for qa in (future.result() for future in futures) if qa is not None]
+
+
+def assign_ids(batches, first_number=1):
+    """Step 4: numbers threads by (batch, position in batch), whatever order the calls finished in"""
+    number = first_number
+    for threads in batches:
+        for qa in threads:
+            qa["id"] = f"qa-thread-{number:03d}"
+            number += 1
+            yield qa
+
+
+def write_output(path, new_threads, append):
+    """
+    Saves the threads, after the ones already in the file when appending
+
+    JSONL output is appended to in place; a JSON array is streamed into a
+    temp file together with the new threads and swapped in.
+
+    Return:
+        int: new threads written
+    """
+    written = 0
+    if path.endswith(".jsonl"):
+        with open(path, "a" if append else "w", encoding="utf-8") as f:
+            for qa in new_threads:
+                f.write(json.dumps(qa, ensure_ascii=False) + "\n")
+                written += 1
+        return written
+
+    tmp_path = f"{path}.tmp"
+    old_threads = iter_records(path) if append and os.path.exists(path) else ()
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        position = 0
+        for is_new, qa in itertools.chain(((False, qa) for qa in old_threads), ((True, qa) for qa in new_threads)):
+            f.write(",\n  " if position else "\n  ")
+            f.write(json.dumps(qa, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+            position += 1
+            written += is_new
+        f.write("\n]")
+    os.replace(tmp_path, path)
+    return written
+
+
+def count_threads(path):
+    if not os.path.exists(path):
+        return 0
+    return sum(1 for _ in iter_records(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn a Discord export into Q&A threads with Claude")
+    parser.add_argument("--input", default=input_path, help="JSON array or JSONL of messages")
+    parser.add_argument("--output", default=output_path, help=".json or .jsonl")
+    parser.add_argument("--checkpoint-dir", default=None, help="defaults to <output>.checkpoints")
+    parser.add_argument("--batch-concurrency", type=int, default=4, help="grouping calls at once")
+    parser.add_argument("--thread-concurrency", type=int, default=8, help="structuring calls at once")
+    parser.add_argument("--full", action="store_true", help="Reprocess the whole export, not just new messages")
+    args = parser.parse_args()
+
+    # Messages before the high-water mark were summarized on an earlier run
+    mark = HighWaterMark(f"{args.output}.state.json")
+    if args.full or not os.path.exists(args.output):
+        mark.processed, mark.last_fingerprint = 0, None
+    new_messages = mark.new_records(lambda: iter_records(args.input))
+    # Batches are read from the export as they are handed out, so only the ones in flight are in memory
+    batches = batched(new_messages, batch_size)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        print(f"No new messages since the last run ({mark.processed} processed).")
+        return
+    first_message = mark.processed
+
+    checkpoint_dir = args.checkpoint_dir or f"{args.output}.checkpoints"
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    checkpoints = []  # every batch's checkpoint, in order; the threads themselves stay on disk
+    failed = []
+    message_count, last_message, resumed = 0, None, 0
+    started = time.time()
+    with ThreadPoolExecutor(args.thread_concurrency) as thread_pool, \
+            ThreadPoolExecutor(args.batch_concurrency) as batch_pool:
+        running = {}
+
+        def collect(done):
+            for future in done:
+                batch_index, path = running.pop(future)
+                threads = future.result()
+                if threads is None:
+                    failed.append(batch_index + 1)  # not checkpointed, so the next run tries it again
+                    continue
+                save_checkpoint(path, threads)
+                print(f"Batch {batch_index + 1} done ({time.time() - started:.0f}s)")
+
+        for batch_index, batch in enumerate(itertools.chain([first_batch], batches)):
+            path = checkpoint_path(checkpoint_dir, first_message + message_count, batch)
+            checkpoints.append(path)
+            message_count += len(batch)
+            last_message = batch[-1]
+            if os.path.exists(path):
+                resumed += 1
+                continue
+            if len(running) >= 2 * args.batch_concurrency:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                collect(done)
+            running[batch_pool.submit(process_batch, batch_index, batch, thread_pool)] = (batch_index, path)
+        collect(as_completed(list(running)))
+
+    print(f"{len(checkpoints)} batches of new messages after message {first_message}, "
+          f"{resumed} resumed from checkpoints")
+    if failed:
+        print(f"Batches {sorted(failed)} failed; run again to retry them. Not writing {args.output}.")
+        return
+
+    append = mark.processed > 0
+    new_threads = assign_ids((load_checkpoint(path) for path in checkpoints),
+                             first_number=count_threads(args.output) + 1 if append else 1)
+    written = write_output(args.output, new_threads, append)
+
+    # Only once the threads are safely written do their messages count as processed
+    mark.advance(message_count, last_message)
+    mark.save()
+    for path in checkpoints:
+        os.remove(path)
+
+    print(f"Done. {written} new Q&A threads {'appended' if append else 'written'} to: {args.output}")
+    # load_data.py reads QA_THREADS_PATH, which is this script's default --output
+    print("To embed them into threads.db (unchanged threads are skipped), from my_discord_bot/ run:")
+    print(f"    python load_data.py --qa-threads {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
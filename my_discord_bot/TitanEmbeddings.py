@@ -1,36 +1,129 @@
 import json
-import boto3
+import threading
 import numpy as np
 import os
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache, cache_key
 
 load_dotenv()
 aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
 aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 aws_region = os.getenv("AWS_DEFAULT_REGION")
 
-aws_client = boto3.client(
-    "bedrock-runtime",
-    region_name=aws_region,
-    aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key
-)
+# Enough HTTP connections for the concurrent embedding workers in load_data.py
+max_connections = int(os.getenv("BEDROCK_MAX_CONNECTIONS", "32"))
+
+_aws_client = None
+_aws_client_lock = threading.Lock()
+
+
+def get_aws_client():
+    """
+    The shared bedrock-runtime client, created on first use
+
+    boto3 and the Bedrock service model take a noticeable part of a second to
+    load, so importing this module does not create the client up front.
+    """
+    global _aws_client
+    with _aws_client_lock:
+        if _aws_client is None:
+            import boto3
+            from botocore.config import Config
+            _aws_client = boto3.client(
+                "bedrock-runtime",
+                region_name=aws_region,
+                aws_access_key_id=aws_access_key,
+                aws_secret_access_key=aws_secret_key,
+                config=Config(max_pool_connections=max_connections)
+            )
+    return _aws_client
+
+
+TITAN_MODEL_ID = "amazon.titan-embed-text-v2:0"
+# Output sizes Titan v2 can return; smaller ones cost a half or a quarter of the
+# memory and scan time (see benchmarks/bench_two_stage.py for what they cost in recall)
+TITAN_DIMENSIONS = (256, 512, 1024)
+# Size load_data.py embeds the corpus at; the bot asks for whatever size the index has
+embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", "1024"))
+if embedding_dimensions not in TITAN_DIMENSIONS:
+    raise ValueError(f"EMBEDDING_DIMENSIONS must be one of {TITAN_DIMENSIONS}, not {embedding_dimensions}")
+
+
+def embedding_model_name(dimensions=embedding_dimensions):
+    """
+    What load_data.py records next to each vector, so changing the size re-embeds everything
+
+    1024 keeps the plain model id, so indexes from before sizes were configurable stay valid.
+    """
+    return TITAN_MODEL_ID if dimensions == 1024 else f"{TITAN_MODEL_ID}@{dimensions}"
+
+# --- Embedding cache (shared by the bot and load_data.py) ---
+# Next to this module, so it is the same file whichever directory the bot or loader runs from
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "embedding_cache.db")
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    The shared embedding cache, opened on first use; None when EMBEDDING_CACHE=0
+
+    Importing this module does not touch the disk, so a script that never
+    embeds anything does not create the SQLite file.
+    """
+    global _embedding_cache
+    if os.getenv("EMBEDDING_CACHE", "1") != "1":
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH),
+                memory_size=int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "1024")),
+                max_disk_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000")),
+            )
+    return _embedding_cache
+
 
 class TitanEmbeddings(object):
     accept = "application/json"
     content_type = "application/json"
     
-    def __init__(self, model_id="amazon.titan-embed-text-v2:0", boto3_client=None, region_name='us-west-1'):
-        
-        if boto3_client:
-            self.bedrock_boto3 = boto3_client
-        else:
-            # self.bedrock_boto3 = boto3.client(service_name='bedrock-runtime')
-            self.bedrock_boto3 = boto3.client(
-                service_name='bedrock-runtime', 
-                region_name=region_name, 
-            )
+    def __init__(self, model_id=TITAN_MODEL_ID, boto3_client=None, region_name='us-west-1', cache=None,
+                 client_factory=None, cache_factory=None):
+        """
+        Args:
+            boto3_client: bedrock-runtime client to use
+            cache (EmbeddingCache): cache to check before calling Titan
+            client_factory (callable): makes the client on the first call instead, when boto3_client is not given
+            cache_factory (callable): returns the cache (or None) on the first call instead, when cache is not given
+        """
+        self._bedrock_boto3 = boto3_client
+        self.region_name = region_name
+        self.client_factory = client_factory
         self.model_id = model_id
+        self._cache = cache
+        self.cache_factory = cache_factory
+
+    @property
+    def cache(self):
+        if self._cache is None and self.cache_factory is not None:
+            self._cache = self.cache_factory()
+            self.cache_factory = None
+        return self._cache
+
+    @property
+    def bedrock_boto3(self):
+        if self._bedrock_boto3 is None:
+            if self.client_factory is not None:
+                self._bedrock_boto3 = self.client_factory()
+            else:
+                import boto3
+                self._bedrock_boto3 = boto3.client(
+                    service_name='bedrock-runtime',
+                    region_name=self.region_name,
+                )
+        return self._bedrock_boto3
 
     def __call__(self, text, dimensions, normalize=True):
         """
@@ -42,9 +135,15 @@ class TitanEmbeddings(object):
             normalize (bool): Whether to return the normalized embedding or not.
 
         Return:
-            List[float]: Embedding
+            np.ndarray: Embedding (float32, read-only when it comes from the cache)
             
         """
+        key = None
+        if self.cache is not None:
+            key = cache_key(self.model_id, dimensions, normalize, text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
 
         body = json.dumps({
             "inputText": text,
@@ -57,30 +156,17 @@ class TitanEmbeddings(object):
         )
 
         response_body = json.loads(response.get('body').read())
+        embedding = np.asarray(response_body['embedding'], dtype=np.float32)
 
-        return response_body['embedding']
+        if key is not None:
+            embedding = self.cache.put(key, embedding)
+        return embedding
 
 
-def generate_titan_vector_embedding(text):
-    bedrock_embeddings = TitanEmbeddings(model_id="amazon.titan-embed-text-v2:0", boto3_client=aws_client)
-    
-    modelId = "amazon.titan-embed-text-v2:0"
-    accept = "application/json"
-    contentType = "application/json"
-
-    body = json.dumps({
-        "inputText": text
-    })
-
-    response = aws_client.invoke_model(
-        body=body,
-        modelId=modelId,
-        accept=accept,
-        contentType=contentType
-    )
-    
-    response_body = json.loads(response.get('body').read())
-    embedding = response_body.get("embedding")
-    return np.array(embedding)
+default_embeddings = TitanEmbeddings(model_id=TITAN_MODEL_ID, client_factory=get_aws_client,
+                                     cache_factory=get_embedding_cache)
+
 
-   
\ No newline at end of file
+def generate_titan_vector_embedding(text, dimensions=None):
+    # Spelled out so they are part of the cache key
+    return default_embeddings(text, dimensions=dimensions or embedding_dimensions, normalize=True)
@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from bedrock_retry import RETRYABLE_ERROR_CODES, is_throttling_error
+
+# Everything here runs on the Discord event loop, so none of it needs locks.
+
+
+def is_throttling(error):
+    """
+    True for a Bedrock throttling error, also when langchain or a worker
+    process passes it on as the text of another exception
+    """
+    if is_throttling_error(error):
+        return True
+    return any(code in str(error) for code in RETRYABLE_ERROR_CODES)
+
+
+class TokenBucket(object):
+    """Refills `rate` tokens a second up to `burst`; a rate of 0 never runs out"""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until take() will succeed"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Shed(Exception):
+    """
+    A question turned away before any Bedrock call
+
+    reason is "user_rate" (the user is over their rate), "queue_full" (no room
+    to wait), "evicted" (pushed out of the queue by a question from a user
+    who had not asked recently) or "cancelled" (sharing the answer of a
+    question whose task was cancelled before it had one).
+    """
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController(object):
+    """
+    Decides which questions get answered, and when.
+
+    A question first needs a token from its user's bucket, or it is shed
+    right away. It then needs one of `slots` answering slots and a token from
+    the global bucket, which paces the Bedrock calls. Questions that have to
+    wait go into a bounded queue where a user's first question in
+    `follow_up_seconds` goes ahead of rapid follow-ups, and a full queue turns
+    the newest follow-up away to make room for someone new.
+
+    Identical questions asked at the same time share one answer (see
+    in_flight_answer).
+
+    Counters in `metrics`: admitted (got a slot), queued (had to wait for it),
+    shed_user_rate, shed_queue_full, shed_evicted and coalesced.
+    """
+
+    def __init__(self, metrics, slots=4, max_queue=50, user_rate=0.1, user_burst=3, global_rate=5.0,
+                 global_burst=10, follow_up_seconds=60.0, max_users=10000):
+        """
+        Args:
+            metrics (Metrics): where the counters go
+            slots (int): questions answered at once
+            max_queue (int): questions allowed to wait for a slot; 0 for no limit
+            user_rate (float): questions per second each user may ask; 0 for no limit
+            user_burst (int): questions a user may ask at once after a quiet spell
+            global_rate (float): questions started per second across all users; 0 for no limit
+            global_burst (int): questions that may start at once after a quiet spell
+            follow_up_seconds (float): how soon after their last question a user's next one is a follow-up
+            max_users (int): users whose bucket is remembered; the longest idle are forgotten first
+        """
+        self.metrics = metrics
+        self.slots = slots
+        self.max_queue = max_queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.follow_up_seconds = follow_up_seconds
+        self.max_users = max_users
+        self.in_flight = 0
+        self._global = TokenBucket(global_rate, global_burst)
+        self._users = OrderedDict()  # user id -> (TokenBucket, time of their last question)
+        self._queue = []  # (priority, arrival, future) heap
+        self._arrivals = itertools.count()
+        self._wakeup = None  # pending call to _dispatch once the global bucket refills
+        self._answers = {}  # coalescing key -> future of the answer being generated
+
+    def __len__(self):
+        """Questions waiting for a slot"""
+        return len(self._queue)
+
+    def check_user(self, user_id):
+        """
+        Takes a token from the user's bucket
+
+        Return:
+            int: queue priority, 0 for a user's first question in a while and 1 for a follow-up
+
+        Raises:
+            Shed: the user is asking faster than their rate
+        """
+        now = time.monotonic()
+        bucket, last_asked = self._users.pop(user_id, (None, None))
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+        self._users[user_id] = (bucket, now)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+        if not bucket.take():
+            self.metrics.count("shed_user_rate")
+            raise Shed("user_rate", retry_after=bucket.wait_time())
+        return 1 if last_asked is not None and now - last_asked < self.follow_up_seconds else 0
+
+    @asynccontextmanager
+    async def slot(self, priority=0):
+        """
+        Holds an answering slot for the block, waiting in the queue if needed
+
+        Raises:
+            Shed: the queue is full, or the question was pushed out of it
+        """
+        if self.in_flight < self.slots and not self._queue and self._global.take():
+            self.in_flight += 1
+        else:
+            await self._wait(priority)
+        self.metrics.count("admitted")
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+    async def _wait(self, priority):
+        entry = (priority, next(self._arrivals), asyncio.get_running_loop().create_future())
+        if self.max_queue and len(self._queue) >= self.max_queue:
+            worst = max(self._queue)
+            if entry[:2] > worst[:2]:
+                self.metrics.count("shed_queue_full")
+                raise Shed("queue_full")
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            worst[2].set_exception(Shed("evicted"))
+            self.metrics.count("shed_evicted")
+        heapq.heappush(self._queue, entry)
+        self.metrics.count("queued")
+        self._dispatch()
+
+        future = entry[2]
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            elif future.done() and not future.cancelled() and future.exception() is None:
+                # Handed a slot at the moment we were cancelled; pass it on
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self):
+        """Hands free slots to the queue's best questions as the global bucket allows"""
+        while self._queue and self.in_flight < self.slots:
+            if not self._global.take():
+                if self._wakeup is None:
+                    self._wakeup = asyncio.get_running_loop().call_later(self._global.wait_time(), self._wake)
+                return
+            priority, arrival, future = heapq.heappop(self._queue)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _wake(self):
+        self._wakeup = None
+        self._dispatch()
+
+    # --- Coalescing ---
+    def in_flight_answer(self, key):
+        """Future of the answer already being generated for this key, or None"""
+        return self._answers.get(key) if key is not None else None
+
+    def lead(self, key):
+        """Registers a question whose answer others with the same key can share; returns its future"""
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._answers[key] = future
+        return future
+
+    def finish(self, key, future, result=None, error=None):
+        """Hands a led question's outcome to everyone sharing it"""
+        if key is not None and self._answers.get(key) is future:
+            del self._answers[key]
+        if future.done():
+            return
+        if error is not None:
+            if not isinstance(error, Exception):
+                # The leader was cancelled (or the bot is shutting down); a CancelledError would
+                # escape the followers' error handling and leave their users without a reply
+                error = Shed("cancelled")
+            future.set_exception(error)
+            future.exception()  # nobody may be sharing it; don't warn about an unretrieved error
+        else:
+            future.set_result(result)
+
+
+def coalesce_key(user_question, sources=None, formatted_conversation=""):
+    """
+    Identical questions share an answer only when neither asker has a
+    conversation going, since history changes what a follow-up means.
+
+    Return:
+        Hashable or None: None when the question must be answered on its own
+    """
+    if formatted_conversation:
+        return None
+    return " ".join(user_question.lower().split()), frozenset(sources) if sources is not None else None
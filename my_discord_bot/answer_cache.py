@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class AnswerCache(object):
+    """
+    Reuses Claude answers for questions that were already answered.
+
+    A stored answer is returned when a new question's embedding is within
+    `threshold` cosine similarity of an earlier one, retrieval picked exactly
+    the same threads, and the index has not been rebuilt since. Entries expire
+    after `ttl_seconds` and the least recently used one is dropped when full.
+    """
+
+    def __init__(self, threshold=0.95, ttl_seconds=86400, max_entries=512):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_version = None
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "invalidations": 0}
+        self._vectors = None  # (max_entries, D) matrix, one row per slot
+        self._entries = OrderedDict()  # slot -> (thread_ids, answer, stored_at), LRU order
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def _check_version(self, index_version):
+        # A re-index can change what the same threads say, so start over
+        if index_version != self.index_version:
+            if self._entries:
+                self.counters["invalidations"] += 1
+            self._entries.clear()
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
+            self._vectors = None  # the new index may use another embedding size
+            self.index_version = index_version
+
+    def _drop(self, slot):
+        del self._entries[slot]
+        self._free_slots.append(slot)
+
+    def lookup(self, query_emb, thread_ids, index_version=None):
+        """
+        Returns a stored answer for this question, or None
+
+        Args:
+            query_emb (np.ndarray): normalized query embedding
+            thread_ids (Iterable[str]): ids of the threads retrieval kept
+            index_version (str): version of the index the threads came from
+        """
+        thread_ids = frozenset(thread_ids)
+        with self._lock:
+            self._check_version(index_version)
+            if not self._entries:
+                self.counters["misses"] += 1
+                return None
+
+            now = time.time()
+            for slot in [slot for slot, entry in self._entries.items() if now - entry[2] > self.ttl_seconds]:
+                self._drop(slot)
+                self.counters["expired"] += 1
+
+            slots = np.fromiter(self._entries.keys(), dtype=np.intp, count=len(self._entries))
+            if len(slots):
+                scores = self._vectors[slots] @ np.asarray(query_emb, dtype=np.float32).ravel()
+                for position in np.argsort(-scores):
+                    if scores[position] < self.threshold:
+                        break
+                    slot = int(slots[position])
+                    if self._entries[slot][0] == thread_ids:
+                        self._entries.move_to_end(slot)
+                        self.counters["hits"] += 1
+                        return self._entries[slot][1]
+
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, query_emb, thread_ids, answer, index_version=None):
+        query_emb = np.asarray(query_emb, dtype=np.float32).ravel()
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(query_emb)), dtype=np.float32)
+            if not self._free_slots:
+                self._drop(next(iter(self._entries)))
+            slot = self._free_slots.pop()
+            self._vectors[slot] = query_emb
+            self._entries[slot] = (frozenset(thread_ids), answer, time.time())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+        return stats
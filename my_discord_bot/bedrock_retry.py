@@ -0,0 +1,44 @@
+import random
+import time
+from botocore.exceptions import ClientError
+
+# Retrying Bedrock calls that were throttled, shared by the embedding calls,
+# load_data.py and discordQASummerizer.py's Claude calls.
+
+# Bedrock error codes that mean "slow down" rather than "this request is bad"
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+
+def is_throttling_error(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+
+
+def call_with_backoff(func, *args, max_attempts=6, base_delay=0.5, max_delay=20.0, on_retry=None):
+    """
+    Calls func, retrying Bedrock throttling errors with jittered exponential backoff
+
+    Args:
+        func (callable): the Bedrock call
+        max_attempts (int): attempts before the last error is raised
+        base_delay (float): seconds to wait after the first throttle
+        max_delay (float): cap on a single wait
+        on_retry (callable): called with (attempt, error) before each wait
+
+    Return:
+        whatever func returns
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return func(*args)
+        except ClientError as e:
+            if not is_throttling_error(e) or attempt == max_attempts:
+                raise
+            if on_retry:
+                on_retry(attempt, e)
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+            time.sleep(delay * random.uniform(0.5, 1.0))
@@ -0,0 +1,95 @@
+"""
+Query latency of the vector index backends as the corpus grows.
+
+Run from my_discord_bot/:
+    python benchmarks/bench_index.py --sizes 500 5000 50000 500000 2000000 --dim 384
+
+Corpora are random unit vectors. "sklearn-scan" is the old path the bot used
+(cosine_similarity over every row + a full argsort); the FAISS rows only run
+when faiss is installed. Random vectors have no cluster structure, so the IVF and
+HNSW recall numbers here are a worst case compared to real embeddings.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_index import NumpyIndex, FaissIndex, build_faiss_index, FAISS_INDEX_TYPES
+
+
+def random_unit_vectors(rng, n, dim):
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+class FullScan(object):
+    """The old bot path: score every row, sort every score."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings.astype(np.float64)
+
+    def search(self, query_emb, top_k):
+        scores = self.embeddings @ query_emb.astype(np.float64)
+        top = np.argsort(scores)[::-1][:top_k]
+        return scores[top], top
+
+
+def time_queries(index, queries, top_k):
+    index.search(queries[0], top_k)  # warm-up
+    started = time.perf_counter()
+    results = [index.search(query, top_k)[1] for query in queries]
+    return (time.perf_counter() - started) / len(queries) * 1000, results
+
+
+def recall(results, exact, top_k):
+    hits = [len(set(found[:top_k]) & set(truth[:top_k])) for found, truth in zip(results, exact)]
+    return sum(hits) / (top_k * len(exact))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 5000, 50000, 500000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--ef-search", type=int, default=64)
+    args = parser.parse_args()
+
+    if importlib.util.find_spec("faiss") is not None:
+        faiss_types = FAISS_INDEX_TYPES
+    else:
+        print("faiss not installed, skipping FAISS backends")
+        faiss_types = ()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>10} {'backend':>14} {'ms/query':>10} {'recall@k':>9} {'build s':>8}")
+    for size in args.sizes:
+        corpus = random_unit_vectors(rng, size, args.dim)
+        # Queries near real rows, like a user asking something the corpus covers
+        queries = corpus[rng.integers(0, size, args.queries)] + 0.05 * random_unit_vectors(rng, args.queries, args.dim)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        backends = [("sklearn-scan", lambda: FullScan(corpus)), ("numpy", lambda: NumpyIndex(corpus))]
+        for index_type in faiss_types:
+            backends.append((f"faiss-{index_type}", lambda t=index_type: FaissIndex(
+                build_faiss_index(corpus, t), nprobe=args.nprobe, ef_search=args.ef_search)))
+
+        exact = None
+        for name, build in backends:
+            started = time.perf_counter()
+            index = build()
+            build_seconds = time.perf_counter() - started
+            ms, results = time_queries(index, queries, args.top_k)
+            if exact is None:
+                exact = results
+            print(f"{size:>10} {name:>14} {ms:>10.3f} {recall(results, exact, args.top_k):>9.3f} {build_seconds:>8.2f}")
+            del index
+
+
+if __name__ == "__main__":
+    main()
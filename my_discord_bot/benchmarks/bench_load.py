@@ -0,0 +1,228 @@
+"""
+Offline load test: replays recorded questions through the bot's on_message.
+
+Run from anywhere (it switches to my_discord_bot/ itself); no Discord token
+or AWS access is needed:
+    python benchmarks/bench_load.py --count 200 --rate 10
+    python benchmarks/bench_load.py --rate 20 --claude-max-rps 8 --output data/load.json
+
+Everything from on_message down is the real code: sessions, the executor,
+retrieval on the real index and threads.db, prompt building, langchain_aws
+and the streaming reply. Bedrock is replaced by benchmarks/fakes.py
+(deterministic embeddings, canned answers, artificial latency and
+throttling) and Discord by fake channels whose sends and edits take
+--discord-latency seconds.
+
+Questions are read from --questions, a JSON array or JSONL file of strings or
+of objects with a "question" (labelled questions) or "content" (Discord
+exports) field, and cycled until --count messages have been sent. They arrive
+at --rate per second, evenly spaced or as a Poisson process, from --users
+users. The embedding and answer caches are off unless --caches is given, so
+every question pays the full path. Admission control (per-user and global
+rate limits, the bounded queue, sharing answers between identical questions)
+is off unless --admission is given, so every message is answered on its own. The bot runs in-process (BOT_WORKERS is ignored).
+
+Reports throughput, end-to-end latency as the user sees it (including time
+queued for a slot), the bot's per-stage percentiles, the fake Bedrock call
+and throttle counts, and resident memory. --output also writes it as JSON,
+to compare runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+import numpy as np
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import FakeBedrockRuntime, FakeModel, FakeChannel, fake_message
+
+CHANNEL_ID_BASE = 1000
+
+
+def rss_bytes():
+    """Resident set size of this process right now"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def read_questions(path):
+    from export_reader import iter_records
+    questions = []
+    for record in iter_records(path):
+        text = record if isinstance(record, str) else record.get("question") or record.get("content")
+        if text and text.strip():
+            questions.append(text.strip())
+    if not questions:
+        raise SystemExit(f"No questions in {path}")
+    return questions
+
+
+def arrival_times(count, rate, arrivals, rng):
+    """Seconds after the start at which each message arrives"""
+    if arrivals == "poisson":
+        return np.cumsum(rng.exponential(1.0 / rate, count)) - 1.0 / rate
+    return np.arange(count) / rate
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"count": len(values), "mean": float(np.mean(values)), "p50": float(p50), "p95": float(p95),
+            "p99": float(p99), "max": float(max(values))}
+
+
+async def replay(bot, questions, args, rng):
+    channels = [FakeChannel(CHANNEL_ID_BASE + n, api_latency=args.discord_latency) for n in range(args.channels)]
+    latencies = []
+    peak_rss = [rss_bytes()]
+    done = asyncio.Event()
+
+    async def sample_memory():
+        while not done.is_set():
+            peak_rss[0] = max(peak_rss[0], rss_bytes())
+            await asyncio.sleep(0.1)
+
+    async def send(position, at, started):
+        await asyncio.sleep(max(0.0, started + at - time.perf_counter()))
+        user = position % args.users
+        message = fake_message(channels[user % len(channels)], user, questions[position % len(questions)])
+        arrived = time.perf_counter()
+        await bot.on_message(message)
+        latencies.append(time.perf_counter() - arrived)
+
+    sampler = asyncio.create_task(sample_memory())
+    started = time.perf_counter()
+    await asyncio.gather(*(send(position, at, started)
+                           for position, at in enumerate(arrival_times(args.count, args.rate, args.arrivals, rng))))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler
+    return channels, latencies, elapsed, peak_rss[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default=os.path.join(BOT_DIR, "benchmarks", "labelled_questions.json"))
+    parser.add_argument("--count", type=int, default=100, help="messages to send")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second")
+    parser.add_argument("--arrivals", choices=["uniform", "poisson"], default="poisson")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--titan-latency", type=float, default=0.08, help="seconds per embedding call")
+    parser.add_argument("--claude-latency", type=float, default=0.6, help="seconds to Claude's first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds per answer token")
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative spread of every fake delay")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of Bedrock calls throttled at random")
+    parser.add_argument("--titan-max-rps", type=float, default=0.0, help="throttle Titan above this rate; 0 for no limit")
+    parser.add_argument("--claude-max-rps", type=float, default=0.0, help="throttle Claude above this rate; 0 for no limit")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="seconds per Discord send or edit")
+    parser.add_argument("--caches", action="store_true", help="keep the embedding and answer caches on")
+    parser.add_argument("--admission", action="store_true",
+                        help="keep the rate limits and queue bound on; shed messages get a busy reply")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the results as JSON here")
+    args = parser.parse_args()
+
+    args.questions = os.path.abspath(args.questions)
+    args.output = args.output and os.path.abspath(args.output)
+
+    # Settings the bot reads at import; anything already set in the environment wins
+    os.chdir(BOT_DIR)
+    os.environ.setdefault("ALLOWED_CHANNEL_IDS", ",".join(str(CHANNEL_ID_BASE + n) for n in range(args.channels)))
+    os.environ.setdefault("SESSION_DB_PATH", "")  # sessions in memory
+    os.environ.setdefault("METRICS_WINDOW", str(max(1000, args.count)))
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    if not args.caches:
+        os.environ.setdefault("EMBEDDING_CACHE", "0")
+        os.environ.setdefault("ANSWER_CACHE", "0")
+    if not args.admission:
+        os.environ.setdefault("USER_QUESTIONS_PER_MINUTE", "0")
+        os.environ.setdefault("GLOBAL_QUESTIONS_PER_SECOND", "0")
+        os.environ.setdefault("MAX_QUEUED_QUESTIONS", "0")
+        os.environ.setdefault("COALESCE_QUESTIONS", "0")
+
+    rss_at_start = rss_bytes()
+    import TitanEmbeddings
+    fake = FakeBedrockRuntime(
+        titan=FakeModel(args.titan_latency, args.jitter, throttle_rate=args.throttle_rate, max_rps=args.titan_max_rps),
+        claude=FakeModel(args.claude_latency, args.jitter, args.token_latency, args.throttle_rate, args.claude_max_rps),
+        answer_tokens=args.answer_tokens,
+        seed=args.seed,
+    )
+    TitanEmbeddings._aws_client = fake  # what get_aws_client hands to the embedder and ChatBedrock
+    import bot
+    fake.anchors = getattr(bot.pipeline.index_snapshots.current.vector_index, "embeddings", None)
+    bot.pipeline.warm_up()
+    rss_loaded = rss_bytes()
+
+    questions = read_questions(args.questions)
+    channels, latencies, elapsed, peak_rss = asyncio.run(replay(bot, questions, args, np.random.default_rng(args.seed)))
+
+    summary = bot.metrics.summary()
+    counters = summary["counters"]
+    answered = counters.get("answered", 0)
+    results = {
+        "settings": vars(args),
+        "elapsed_seconds": elapsed,
+        "offered_rate": args.count / elapsed if args.count else 0.0,
+        "throughput": answered / elapsed if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "stages": summary["histograms"],
+        "counters": counters,
+        "bedrock": {
+            "titan_calls": fake.titan.calls, "titan_throttled": fake.titan.throttled,
+            "claude_calls": fake.claude.calls, "claude_throttled": fake.claude.throttled,
+        },
+        "discord": {"sends": sum(len(channel.sent) for channel in channels),
+                    "edits": sum(channel.edits for channel in channels)},
+        "memory_mb": {
+            "start": rss_at_start / 2 ** 20,
+            "loaded": rss_loaded / 2 ** 20,
+            "peak": max(peak_rss, rss_loaded) / 2 ** 20,
+            "end": rss_bytes() / 2 ** 20,
+        },
+    }
+
+    print(bot.metrics.format_summary(bot.pipeline.STAGES))
+    print()
+    print(f"{args.count} messages in {elapsed:.2f}s from {args.users} users "
+          f"({args.arrivals} arrivals at {args.rate:g}/s, {bot.config.max_in_flight_questions} in flight)")
+    shed = sum(amount for name, amount in counters.items() if name.startswith("shed_"))
+    print(f"throughput {results['throughput']:.2f} answers/s, {answered} answered, {counters.get('failed', 0)} failed, "
+          f"{shed} shed, {counters.get('coalesced', 0)} coalesced")
+    latency = results["latency"]
+    if latency:
+        print(f"end to end p50={latency['p50']:.3f}s p95={latency['p95']:.3f}s "
+              f"p99={latency['p99']:.3f}s max={latency['max']:.3f}s")
+    bedrock = results["bedrock"]
+    print(f"titan calls={bedrock['titan_calls']} throttled={bedrock['titan_throttled']}, "
+          f"claude calls={bedrock['claude_calls']} throttled={bedrock['claude_throttled']}")
+    print(f"discord sends={results['discord']['sends']} edits={results['discord']['edits']}")
+    memory = results["memory_mb"]
+    print(f"memory MB: start {memory['start']:.0f}, loaded {memory['loaded']:.0f}, "
+          f"peak {memory['peak']:.0f}, end {memory['end']:.0f}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
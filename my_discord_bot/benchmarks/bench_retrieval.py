@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of the relevance filter strategies in retrieval.py.
+
+Run from my_discord_bot/:
+    python benchmarks/bench_retrieval.py --top-k 20
+
+"python-dropoff" is the loop the bot used before (list of z-scores, sorted
+zip, Python scan for the largest gap). Scores are synthetic top-k cosine
+hits; MMR also gets random unit vectors for the candidates.
+"""
+import argparse
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval import select_dropoff, select_threshold, select_mmr
+
+
+def python_dropoff(cosine_scores, top_indices):
+    mean = np.mean(cosine_scores)
+    std_deviation = np.std(cosine_scores, ddof=1)
+    z_scores = [(x - mean) / std_deviation if std_deviation != 0 else 0 for x in cosine_scores]
+    sorted_z = sorted(zip(top_indices, cosine_scores, z_scores), key=lambda x: x[2], reverse=True)
+    max_gap, best_cutoff_idx = 0, 0
+    for i in range(1, len(sorted_z)):
+        gap = sorted_z[i - 1][2] - sorted_z[i][2]
+        if gap > max_gap:
+            max_gap = gap
+            best_cutoff_idx = i
+    return sorted_z[:best_cutoff_idx], z_scores, max_gap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'top_k':>6} {'strategy':>15} {'us/call':>9}")
+    for top_k in args.top_k:
+        scores = np.sort(rng.uniform(0.2, 0.8, top_k).astype(np.float32))[::-1]
+        indices = np.arange(top_k)
+        vectors = rng.standard_normal((top_k, args.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        query = vectors[0]
+
+        strategies = {
+            "python-dropoff": lambda: python_dropoff(scores, indices),
+            "dropoff": lambda: select_dropoff(scores, indices),
+            "threshold": lambda: select_threshold(scores, indices),
+            "mmr": lambda: select_mmr(scores, indices, vectors, query),
+        }
+        for name, call in strategies.items():
+            seconds = timeit.timeit(call, number=args.repeat) / args.repeat
+            print(f"{top_k:>6} {name:>15} {seconds * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Startup-time benchmark for the bot.
+
+Run from my_discord_bot/:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --connect   # also log in to Discord (needs DISCORD_TOKEN)
+
+Every run is a fresh interpreter, so module imports are paid each time like
+on a restart (the OS file cache stays warm after the first run). Phases:
+    import     import bot (discord, the mmap'd index, threads.db, sessions)
+    connect    client.start() until on_ready, with --connect
+    warmup     pipeline.warm_up: langchain_aws, Bedrock clients, page-in, index check
+"ready before connect" is import, which is all the bot now does before
+connecting; adding warmup gives what it paid when everything was loaded
+eagerly at import.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+import bot
+imported = time.perf_counter()
+timings = {"import": imported - started, "langchain_at_import": "langchain_aws" in sys.modules}
+if CONNECT:
+    import asyncio
+
+    async def connect():
+        ready = asyncio.Event()
+
+        @bot.client.event
+        async def on_ready():
+            ready.set()
+
+        task = asyncio.create_task(bot.client.start(bot.config.discord_token))
+        started = time.perf_counter()
+        await ready.wait()
+        timings["connect"] = time.perf_counter() - started
+        await bot.client.close()
+        await task
+
+    asyncio.run(connect())
+warm_started = time.perf_counter()
+bot.pipeline.warm_up()
+timings["warmup"] = time.perf_counter() - warm_started
+print(json.dumps(timings))
+"""
+
+
+def run_once(connect):
+    probe = PROBE.replace("CONNECT", "True" if connect else "False")
+    output = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--connect", action="store_true", help="log in to Discord as part of each run")
+    args = parser.parse_args()
+
+    runs = [run_once(args.connect) for _ in range(args.runs)]
+    phases = ["import"] + (["connect"] if args.connect else []) + ["warmup"]
+    print(f"{args.runs} cold starts")
+    print(f"{'phase':>22} {'p50 s':>7} {'max s':>7}")
+    for phase in phases:
+        values = [run[phase] for run in runs]
+        print(f"{phase:>22} {np.median(values):>7.3f} {max(values):>7.3f}")
+    print(f"{'ready before connect':>22} {np.median([run['import'] for run in runs]):>7.3f}")
+    print(f"{'eager (import+warmup)':>22} {np.median([run['import'] + run['warmup'] for run in runs]):>7.3f}")
+    if any(run["langchain_at_import"] for run in runs):
+        print("Warning: langchain_aws was imported before connecting")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Recall vs memory for the compact embedding store dtypes.
+
+Run from my_discord_bot/:
+    python benchmarks/bench_store.py --rows 200000
+
+Starts from models/embeddings.npy (or random vectors with --random) and grows
+it to --rows by adding jittered copies. Each dtype is written with
+write_store, memory-mapped back with open_store and searched with NumpyIndex;
+recall@k is measured against the float64 full scan the bot used before.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_store import write_store, open_store, STORE_DTYPES
+from vector_index import NumpyIndex
+
+
+def normalize_rows(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_corpus(rng, args):
+    if args.random or not os.path.exists(args.embeddings):
+        base = normalize_rows(rng.standard_normal((min(args.rows, 1000), args.dim)).astype(np.float32))
+    else:
+        base = np.load(args.embeddings).astype(np.float32)
+    copies = [base]
+    while sum(len(c) for c in copies) < args.rows:
+        copies.append(normalize_rows(base + 0.05 * rng.standard_normal(base.shape).astype(np.float32)))
+    return np.concatenate(copies)[:args.rows]
+
+
+def store_bytes(store):
+    total = store.vectors.nbytes + store.ids.packed.nbytes
+    if store.scales is not None:
+        total += store.scales.nbytes
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", default="models/embeddings.npy")
+    parser.add_argument("--random", action="store_true", help="Use random vectors instead of the real embeddings")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024, help="Only used with --random")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = build_corpus(rng, args)
+    ids = [f"thread-{i:07d}" for i in range(len(corpus))]
+    queries = normalize_rows(corpus[rng.integers(0, len(corpus), args.queries)]
+                             + 0.05 * rng.standard_normal((args.queries, corpus.shape[1])).astype(np.float32))
+
+    # The old bot path: float64 matrix, every row scored, full argsort
+    baseline = corpus.astype(np.float64)
+    started = time.perf_counter()
+    exact = [np.argsort(baseline @ query.astype(np.float64))[::-1][:args.top_k] for query in queries]
+    baseline_ms = (time.perf_counter() - started) / len(queries) * 1000
+    id_list_bytes = sum(sys.getsizeof(thread_id) for thread_id in ids) + sys.getsizeof(ids)
+
+    print(f"{len(corpus)} rows x {corpus.shape[1]} dims, recall@{args.top_k} against the float64 scan")
+    print(f"{'format':>10} {'MB':>9} {'ms/query':>10} {'recall':>7} {'open ms':>8}")
+    print(f"{'float64':>10} {(baseline.nbytes + id_list_bytes) / 1e6:>9.1f} {baseline_ms:>10.3f} {1.0:>7.3f} {'-':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for dtype in STORE_DTYPES:
+            path = os.path.join(directory, dtype)
+            write_store(path, corpus, ids, dtype)
+
+            started = time.perf_counter()
+            store = open_store(path)
+            open_ms = (time.perf_counter() - started) * 1000
+
+            index = NumpyIndex(store.vectors, scales=store.scales)
+            index.search(queries[0], args.top_k)  # fault the pages in
+            started = time.perf_counter()
+            found = [index.search(query, args.top_k)[1] for query in queries]
+            ms = (time.perf_counter() - started) / len(queries) * 1000
+
+            hits = sum(len(set(f) & set(e)) for f, e in zip(found, exact))
+            recall = hits / (args.top_k * len(queries))
+            print(f"{dtype:>10} {store_bytes(store) / 1e6:>9.1f} {ms:>10.3f} {recall:>7.3f} {open_ms:>8.2f}")
+            del index, store
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Recall and latency of smaller Titan embeddings and two-stage search.
+
+Run from my_discord_bot/:
+    python benchmarks/bench_two_stage.py --titan                 # real Titan vectors at 256, 512 and 1024 dims
+    python benchmarks/bench_two_stage.py --rows 200000           # offline, models/embeddings.npy grown to 200k rows
+
+With --titan the corpus is every thread the bot answers from and the
+queries are the labelled questions, all embedded at each of --dimensions
+(needs Bedrock the first time; the embedding cache makes re-runs free).
+Recall@k is measured against the exact float32 search at the largest size,
+so it includes what a smaller size costs, and "hit" is the share of
+questions with a labelled relevant thread in the top k.
+
+Offline there is only the stored size: queries are corpus rows plus noise
+and recall is against the exact float32 search at that size.
+
+Every size is searched with each setting: the exact float32 and int8 scans,
+and two-stage search (vector_index.TwoStageIndex) with an int8 or PCA coarse
+copy at each of --candidates. "hot MB" is what every query reads, so what
+has to stay in the page cache for the latency shown: all the vectors for an
+exact scan; for two-stage the coarse copy plus the candidates' full rows
+(the rest of the full vectors can be paged out). "MB" is everything on disk.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from embedding_store import write_store, open_store
+from snapshots import current_version
+from vector_index import NumpyIndex, load_index
+from bench_store import build_corpus, normalize_rows
+
+
+def snapshot_threads_db():
+    """threads.db of the snapshot the bot answers from, or the unversioned one"""
+    version = current_version(config.snapshot_dir)
+    if version is None:
+        return config.threads_db_path
+    return os.path.join(config.snapshot_dir, version, "threads.db")
+
+
+def titan_vectors(texts, dimensions, concurrency):
+    from TitanEmbeddings import generate_titan_vector_embedding
+    from bedrock_retry import call_with_backoff
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        vectors = list(executor.map(
+            lambda text: call_with_backoff(generate_titan_vector_embedding, text, dimensions), texts
+        ))
+    return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+def titan_corpora(args):
+    """{dims: (corpus, queries)} embedded by Titan, with the thread ids and labelled relevant ids"""
+    conn = sqlite3.connect(snapshot_threads_db())
+    rows = conn.execute("SELECT id, content FROM threads ORDER BY rowid").fetchall()
+    conn.close()
+    ids = [thread_id for thread_id, content in rows]
+    with open(args.labels) as f:
+        labelled = json.load(f)
+
+    corpora = {}
+    for dimensions in sorted(args.dimensions):
+        print(f"Embedding {len(rows)} threads and {len(labelled)} questions at {dimensions} dims")
+        corpus = titan_vectors([content for thread_id, content in rows], dimensions, args.concurrency)
+        queries = titan_vectors([example["question"] for example in labelled], dimensions, args.concurrency)
+        corpora[dimensions] = (corpus, queries)
+    return corpora, ids, [set(example["relevant"]) for example in labelled]
+
+
+def offline_corpora(args):
+    rng = np.random.default_rng(0)
+    corpus = build_corpus(rng, args)
+    queries = normalize_rows(corpus[rng.integers(0, len(corpus), args.queries)]
+                             + 0.05 * rng.standard_normal((args.queries, corpus.shape[1])).astype(np.float32))
+    return {corpus.shape[1]: (corpus, queries)}, [f"thread-{i:07d}" for i in range(len(corpus))], None
+
+
+def megabytes(*arrays):
+    return sum(array.nbytes for array in arrays if array is not None) / 1e6
+
+
+def settings(directory, corpus, ids, args):
+    """Yields (name, index, MB, hot MB) for every search setting over this corpus"""
+    write_store(os.path.join(directory, "float32"), corpus, ids, "float32")
+    store = open_store(os.path.join(directory, "float32"))
+    yield "exact float32", NumpyIndex(store.vectors), megabytes(store.vectors), megabytes(store.vectors)
+
+    write_store(os.path.join(directory, "int8"), corpus, ids, "int8")
+    store = open_store(os.path.join(directory, "int8"))
+    size = megabytes(store.vectors, store.scales)
+    yield "exact int8", NumpyIndex(store.vectors, scales=store.scales), size, size
+
+    coarse_settings = [("int8", "int8", 0)] + [(f"pca{dims}", "pca", dims) for dims in args.pca_dims]
+    for name, coarse, coarse_dims in coarse_settings:
+        path = os.path.join(directory, name)
+        write_store(path, corpus, ids, "float32", coarse=coarse, coarse_dims=coarse_dims)
+        store = open_store(path)
+        coarse_mb = megabytes(store.coarse, store.coarse_scales, store.projection)
+        for candidates in args.candidates:
+            index = load_index("two_stage", store=store, candidates=candidates)
+            rows_mb = candidates * store.vectors.shape[1] * store.vectors.itemsize / 1e6
+            yield (f"2-stage {name} c={candidates}", index, megabytes(store.vectors) + coarse_mb,
+                   coarse_mb + rows_mb)
+
+
+def time_search(index, queries, top_k):
+    index.search(queries[0], top_k)  # fault the pages in
+    started = time.perf_counter()
+    found = [index.search(query, top_k)[1] for query in queries]
+    return found, (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--titan", action="store_true", help="embed the real corpus with Titan at each size")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--labels", default="benchmarks/labelled_questions.json")
+    parser.add_argument("--concurrency", type=int, default=8, help="Titan requests in flight at once")
+    parser.add_argument("--embeddings", default="models/embeddings.npy", help="offline corpus to grow from")
+    parser.add_argument("--random", action="store_true", help="offline: random vectors instead of the embeddings")
+    parser.add_argument("--rows", type=int, default=100000, help="offline corpus size")
+    parser.add_argument("--dim", type=int, default=1024, help="only used with --random")
+    parser.add_argument("--queries", type=int, default=100, help="offline queries")
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--pca-dims", type=int, nargs="+", default=[64, 128])
+    args = parser.parse_args()
+
+    corpora, ids, relevant = titan_corpora(args) if args.titan else offline_corpora(args)
+    largest = max(corpora)
+    reference_corpus, reference_queries = corpora[largest]
+    reference = [set(NumpyIndex(reference_corpus).search(query, args.top_k)[1]) for query in reference_queries]
+
+    print(f"{len(ids)} rows, {len(reference)} queries, recall@{args.top_k} against exact float32 at {largest} dims")
+    print(f"{'dims':>5} {'setting':<24} {'MB':>8} {'hot MB':>8} {'ms/query':>9} {'recall':>7}"
+          + (f" {'hit':>5}" if relevant else ""))
+    for dimensions, (corpus, queries) in sorted(corpora.items()):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, index, mb, hot_mb in settings(directory, corpus, ids, args):
+                found, ms = time_search(index, queries, args.top_k)
+                recall = np.mean([len(set(f) & r) / len(r) for f, r in zip(found, reference)])
+                line = f"{dimensions:>5} {name:<24} {mb:>8.1f} {hot_mb:>8.1f} {ms:>9.3f} {recall:>7.3f}"
+                if relevant:
+                    hit = np.mean([bool({ids[i] for i in f} & r) for f, r in zip(found, relevant)])
+                    line += f" {hit:>5.2f}"
+                print(line)
+                del index
+
+
+if __name__ == "__main__":
+    main()
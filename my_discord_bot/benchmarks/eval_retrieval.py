@@ -0,0 +1,141 @@
+"""
+Offline evaluation of the relevance filter strategies on labelled questions.
+
+Run from my_discord_bot/ (needs Bedrock access for the question embeddings,
+which land in the embedding cache so re-runs are free):
+    python benchmarks/eval_retrieval.py --labels benchmarks/labelled_questions.json
+
+The labels file is a list of {"question": ..., "relevant": [thread ids]}.
+For every strategy it reports how often at least one relevant thread made it
+into the prompt (hit rate), recall and precision of the kept threads, how
+many threads were kept on average and how long the filter took.
+
+Every strategy is run once per partition mode (--partition-modes, see
+PARTITION_MODE in config.py), searching the way retrieve_context does;
+"reachable" is the share of relevant threads in the partitions searched,
+so what a classify run loses to the keyword classifier shows up there, and
+each mode is compared with the flat search ("off"): how many of its top-k
+candidates are the same and how many rows it scanned per question.
+
+--self-queries needs no labels or Bedrock: every indexed thread is asked
+its own title with its own vector as the embedding, and is the one relevant
+thread. A partition mode that ranks a thread below others for an exact
+match of itself, or filters it out, loses hit rate against "off" there.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from TitanEmbeddings import generate_titan_vector_embedding
+from retrieval import select_threads, cap_categories, STRATEGIES
+from partitions import select_partitions, search_partitions, search_selected, in_partitions
+from snapshots import IndexSnapshot, current_version
+from thread_store import ThreadStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", default="benchmarks/labelled_questions.json")
+    parser.add_argument("--self-queries", action="store_true", help="ask every thread its own title instead")
+    parser.add_argument("--top-k", type=int, default=config.retrieval_top_k)
+    parser.add_argument("--max-per-category", type=int, default=0)
+    parser.add_argument("--partition-modes", nargs="+", choices=["off", "all", "classify"],
+                        default=["off", "all", "classify"])
+    args = parser.parse_args()
+
+    # The snapshot the bot answers from
+    snapshot = IndexSnapshot.open(config, config.snapshot_dir, current_version(config.snapshot_dir))
+    thread_store = ThreadStore(snapshot.thread_store.db_path, in_memory=True)
+
+    embedded = []
+    if args.self_queries:
+        titles = thread_store.fetch(snapshot.id_map)
+        for row, (thread_id, (title, content)) in enumerate(zip(snapshot.id_map, titles)):
+            query_emb = snapshot.vector_index.vectors([row])[0]
+            embedded.append(({"question": title, "relevant": [thread_id]}, query_emb / np.linalg.norm(query_emb)))
+    else:
+        with open(args.labels) as f:
+            labelled = json.load(f)
+        for example in labelled:
+            query_emb = np.asarray(generate_titan_vector_embedding(example["question"]), dtype=np.float32)
+            embedded.append((example, query_emb / np.linalg.norm(query_emb)))
+
+    # What every partition mode is compared with
+    flat = [set(snapshot.vector_index.search(query_emb, args.top_k)[1]) for example, query_emb in embedded]
+
+    print(f"{len(embedded)} questions, top {args.top_k} candidates each")
+    for mode in args.partition_modes:
+        evaluate(mode, embedded, snapshot, thread_store, flat, args)
+
+
+def search(mode, snapshot, question, query_emb, top_k):
+    """
+    (scores, indices, partitions searched, rows scanned) the way retrieve_context
+    searches in this PARTITION_MODE
+    """
+    if mode == "off":
+        scores, indices = snapshot.vector_index.search(query_emb, top_k)
+        return scores, indices, None, len(snapshot.vector_index)
+    partitions, picked = select_partitions(snapshot.partitions(), question, mode=mode)
+    if not picked:
+        scores, indices, scanned = search_partitions(snapshot.vector_index, partitions, query_emb, top_k)
+        return scores, indices, partitions, scanned
+    scores, indices, scanned, partitions, _ = search_selected(
+        snapshot.vector_index, snapshot.partitions(), partitions, query_emb, top_k,
+        min_score=config.retrieval_min_score, min_hits=config.partition_min_hits,
+    )
+    return scores, indices, partitions, scanned
+
+
+def evaluate(mode, embedded, snapshot, thread_store, flat, args):
+    index, id_map = snapshot.vector_index, snapshot.id_map
+    positions = snapshot.id_positions()
+    queries, reachable, same_as_flat, scanned_rows = [], [], [], []
+    for (example, query_emb), flat_indices in zip(embedded, flat):
+        scores, indices, partitions, scanned = search(mode, snapshot, example["question"], query_emb, args.top_k)
+        queries.append((example, query_emb, scores, indices))
+        reachable.extend(
+            thread_id in positions and (partitions is None or in_partitions(partitions, positions[thread_id]))
+            for thread_id in example["relevant"]
+        )
+        same_as_flat.append(len(flat_indices & set(indices)) / max(1, len(flat_indices)))
+        scanned_rows.append(scanned)
+
+    print(f"\nPARTITION_MODE={mode}: {np.mean(reachable):.0%} of the relevant threads reachable, "
+          f"{np.mean(same_as_flat):.0%} of the top {args.top_k} same as off, "
+          f"{np.mean(scanned_rows):.0f} of {len(index)} rows scanned per question")
+    print(f"{'strategy':>10} {'hit rate':>9} {'recall':>7} {'precision':>10} {'kept':>6} {'us/query':>9}")
+    for strategy in STRATEGIES:
+        hits, recalls, precisions, kept_counts, elapsed = 0, [], [], [], 0.0
+        for example, query_emb, scores, indices in queries:
+            started = time.perf_counter()
+            vectors = index.vectors(indices) if strategy == "mmr" else None
+            top_threads, z, gap = select_threads(strategy, scores, indices, vectors=vectors, query_emb=query_emb,
+                                                 min_score=config.retrieval_min_score,
+                                                 max_threads=config.retrieval_max_threads,
+                                                 diversity=config.mmr_diversity)
+            if args.max_per_category:
+                categories = thread_store.categories([id_map[idx] for idx, cos_sim, z_score in top_threads])
+                top_threads = cap_categories(top_threads, categories, args.max_per_category)
+            elapsed += time.perf_counter() - started
+
+            kept = {id_map[idx] for idx, cos_sim, z_score in top_threads}
+            relevant = set(example["relevant"])
+            found = len(kept & relevant)
+            hits += found > 0
+            recalls.append(found / len(relevant))
+            precisions.append(found / len(kept) if kept else 0.0)
+            kept_counts.append(len(kept))
+
+        count = len(queries)
+        print(f"{strategy:>10} {hits / count:>9.2f} {np.mean(recalls):>7.2f} {np.mean(precisions):>10.2f} "
+              f"{np.mean(kept_counts):>6.1f} {elapsed / count * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
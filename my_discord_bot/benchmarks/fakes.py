@@ -0,0 +1,196 @@
+"""
+Local stand-ins for bedrock-runtime and Discord, for the offline benchmarks.
+
+FakeBedrockRuntime answers the two calls the bot makes through boto3
+(invoke_model and invoke_model_with_response_stream) in the formats Titan
+and Claude use, so TitanEmbeddings and langchain_aws run unchanged on top of
+it. FakeChannel and fake_message have the few attributes on_message, send_long
+and StreamingReply touch.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import types
+from botocore.exceptions import ClientError
+import numpy as np
+
+
+class FakeModel(object):
+    """
+    Latency and throttling of one fake Bedrock model
+
+    Args:
+        latency (float): seconds per call (Titan) or to the first token (Claude)
+        jitter (float): each delay is scaled by a uniform factor in [1 - jitter, 1 + jitter]
+        token_latency (float): seconds between streamed tokens
+        throttle_rate (float): share of calls rejected with a ThrottlingException
+        max_rps (float): calls per second above which calls are throttled; 0 for no limit
+    """
+
+    def __init__(self, latency=0.0, jitter=0.2, token_latency=0.0, throttle_rate=0.0, max_rps=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.calls = 0
+        self.throttled = 0
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def delay(self, seconds, rng):
+        if seconds > 0:
+            time.sleep(seconds * rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def admit(self, rng, operation):
+        """Counts the call, raising the error Bedrock sends when it is throttled"""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._recent = [at for at in self._recent if now - at < 1.0]
+            throttled = rng.random() < self.throttle_rate or (self.max_rps and len(self._recent) >= self.max_rps)
+            if throttled:
+                self.throttled += 1
+            else:
+                self._recent.append(now)
+        if throttled:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."}},
+                operation,
+            )
+
+
+class FakeBedrockRuntime(object):
+    """
+    bedrock-runtime client with deterministic embeddings and canned answers.
+
+    The embedding of a text only depends on the text. With `anchors` (the
+    index's own vectors) it is a stored vector chosen by the text's hash plus
+    some noise, so queries find a realistic handful of close threads instead
+    of nothing, and has the anchors' size whatever size was asked for (so it
+    also fits a sample index built at another size); otherwise it is a random
+    unit vector seeded by the text.
+
+    Claude answers are `answer_tokens` words long and come back whole or as
+    a stream of content_block_delta events, one word each.
+    """
+
+    def __init__(self, titan=None, claude=None, anchors=None, noise=0.05, answer_tokens=150, seed=0):
+        self.titan = titan or FakeModel()
+        self.claude = claude or FakeModel()
+        self.anchors = anchors
+        self.noise = noise
+        self.answer_tokens = answer_tokens
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _random(self):
+        with self._rng_lock:
+            return random.Random(self._rng.random())
+
+    def embed(self, text, dimensions):
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        rng = np.random.default_rng(seed)
+        if self.anchors is not None:
+            vector = self.anchors[seed % len(self.anchors)].astype(np.float32)
+            vector = vector + rng.normal(0, self.noise, vector.shape[0]).astype(np.float32)
+        else:
+            vector = rng.standard_normal(dimensions).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def answer_words(self, prompt):
+        return [f"word{n}" for n in range(self.answer_tokens)]
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None, **kwargs):
+        request = json.loads(body)
+        rng = self._random()
+        if "inputText" in request:
+            self.titan.admit(rng, "InvokeModel")
+            self.titan.delay(self.titan.latency, rng)
+            embedding = self.embed(request["inputText"], request.get("dimensions", 1024))
+            payload = {"embedding": embedding.tolist(), "inputTextTokenCount": len(request["inputText"]) // 4 + 1}
+            return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+
+        self.claude.admit(rng, "InvokeModel")
+        words = self.answer_words(request)
+        self.claude.delay(self.claude.latency + self.claude.token_latency * len(words), rng)
+        input_tokens = len(body) // 4 + 1
+        payload = {
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": " ".join(words)}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(words)},
+        }
+        headers = {
+            "x-amzn-bedrock-input-token-count": str(input_tokens),
+            "x-amzn-bedrock-output-token-count": str(len(words)),
+        }
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "ResponseMetadata": {"HTTPHeaders": headers}}
+
+    def invoke_model_with_response_stream(self, body, modelId, accept=None, contentType=None, **kwargs):
+        rng = self._random()
+        self.claude.admit(rng, "InvokeModelWithResponseStream")
+        words = self.answer_words(json.loads(body))
+        input_tokens = len(body) // 4 + 1
+
+        def event(payload):
+            return {"chunk": {"bytes": json.dumps(payload).encode("utf-8")}}
+
+        def events():
+            self.claude.delay(self.claude.latency, rng)
+            yield event({"type": "message_start", "message": {"role": "assistant", "content": [],
+                                                              "usage": {"input_tokens": input_tokens, "output_tokens": 0}}})
+            yield event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            for position, word in enumerate(words):
+                if position:
+                    self.claude.delay(self.claude.token_latency, rng)
+                text = word if position == 0 else " " + word
+                yield event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}})
+            yield event({"type": "content_block_stop", "index": 0})
+            yield event({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                         "usage": {"output_tokens": len(words)}})
+            yield event({"type": "message_stop", "amazon-bedrock-invocationMetrics": {
+                "inputTokenCount": input_tokens, "outputTokenCount": len(words)}})
+
+        return {"body": events()}
+
+
+class FakeSentMessage(object):
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        await self.channel.api_call()
+        self.content = content
+        self.channel.edits += 1
+
+
+class FakeChannel(object):
+    """A text channel; every send or edit waits `api_latency` seconds like a Discord API call"""
+
+    def __init__(self, channel_id, api_latency=0.0):
+        self.id = channel_id
+        self.api_latency = api_latency
+        self.sent = []
+        self.edits = 0
+
+    async def api_call(self):
+        if self.api_latency > 0:
+            await asyncio.sleep(self.api_latency)
+
+    async def send(self, content):
+        await self.api_call()
+        message = FakeSentMessage(self, content)
+        self.sent.append(message)
+        return message
+
+
+def fake_message(channel, user_id, content):
+    """What on_message reads from a discord.Message"""
+    return types.SimpleNamespace(author=types.SimpleNamespace(id=user_id), channel=channel, content=content)
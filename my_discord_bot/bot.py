@@ -1,98 +1,277 @@
+import time
+process_started = time.perf_counter()
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import discord
-import sqlite3
-import numpy as np
-import os
-#from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from dotenv import load_dotenv
-import boto3
-from TitanEmbeddings import TitanEmbeddings, generate_titan_vector_embedding
+import config
+import pipeline
+from replies import StreamingReply, send_long
+from TitanEmbeddings import get_embedding_cache
+from sessions import SessionStore
+from admission import AdmissionController, Shed, coalesce_key, is_throttling
 # ssh -i /Users/dan/Downloads/discord-bot.pem ec2-user@35.171.22.127
 
-# --- Z-score filter ---
-def calculate_zscores(cosine_scores):
-    mean = np.mean(cosine_scores)
-    std_deviation = np.std(cosine_scores, ddof=1)
-    return [(x - mean) / std_deviation if std_deviation != 0 else 0 for x in cosine_scores]
-
-# --- Environment & Keys ---
-load_dotenv()
-discord_token = os.getenv("DISCORD_TOKEN")
-aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-aws_region = os.getenv("AWS_DEFAULT_REGION")
-channel = 1375597403750797493
-
-# --- AWS Claude Setup ---
-aws_client = boto3.client(
-    "bedrock-runtime",
-    region_name=aws_region,
-    aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key
-)
-
-model_id = "anthropic.claude-3-haiku-20240307-v1:0"
-
-model_kwargs = {
-    "max_tokens": 2048,
-    "temperature": 0.0,
-    "top_k": 250,
-    "top_p": 0.9,
-    "stop_sequences": ["\n\nHuman"],
-}
-
-from langchain_aws import ChatBedrock
-llm = ChatBedrock(client=aws_client, model_id=model_id, model_kwargs=model_kwargs)
+# Bedrock clients and langchain are not loaded yet; see pipeline.warm_up
+imported_at = time.perf_counter()
 
 # --- Discord Setup ---
 intents = discord.Intents.default()
 intents.message_content = True
 client = discord.Client(intents=intents)
 
-# Load embeddings & index map
-model = TitanEmbeddings(boto3_client=aws_client)
+# --- Request pipeline ---
+# Bedrock and SQLite calls run on this pool so the gateway loop keeps serving
+# heartbeats and other users while one question waits on Claude.
+executor = ThreadPoolExecutor(max_workers=config.max_in_flight_questions, thread_name_prefix="pipeline")
+# Session lookups and metrics exports take milliseconds; on their own pool they
+# don't queue behind answers that hold every pipeline thread for a Claude stream,
+# and the event loop never waits on the session lock while add_turn commits.
+bookkeeping_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bookkeeping")
+metrics = pipeline.metrics
+# Rate limits, the queue for a free slot and load shedding, in front of every Bedrock call
+admission = AdmissionController(
+    metrics,
+    slots=config.max_in_flight_questions,
+    max_queue=config.max_queued_questions,
+    user_rate=config.user_questions_per_minute / 60,
+    user_burst=config.user_question_burst,
+    global_rate=config.global_questions_per_second,
+    global_burst=config.global_question_burst,
+    follow_up_seconds=config.follow_up_seconds,
+    max_users=config.session_max_active,
+)
+
+
+def pipeline_stats():
+    return {
+        "queued": len(admission),           # questions waiting for a free slot
+        "in_flight": admission.in_flight,  # questions being answered right now
+    }
+
+# Supervisor mode (BOT_WORKERS > 0): started in __main__, answers come from worker processes
+worker_pool = None
+
+# Conversation history and /show_context data, per (channel, user)
+sessions = SessionStore(
+    max_turns=config.session_max_turns,
+    history_tokens=config.session_history_tokens,
+    idle_seconds=config.session_idle_seconds,
+    max_sessions=config.session_max_active,
+    db_path=config.session_db_path or None,
+)
+
 
-embeddings = np.load("models/embeddings.npy")  # shape: (N, 384), already normalized
-with open("models/id_map.txt") as f:
-    id_map = f.read().splitlines()
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+async def run_bookkeeping(func, *args):
+    """run_blocking for short SQLite and file calls that must not wait for a free pipeline thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(bookkeeping_executor, func, *args)
+
+
+async def stream_blocking(generator_func, *args):
+    """Runs a blocking generator on the executor and yields its items on the event loop"""
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for item in generator_func(*args):
+                loop.call_soon_threadsafe(items.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(items.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(items.put_nowait, done)
+
+    producer = loop.run_in_executor(executor, produce)
+    while True:
+        item = await items.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    await producer
+
+
+def latency_summary():
+    total = metrics.summary()["histograms"].get("total")
+    if not total:
+        return "no answers yet"
+    return f"p50={total['p50']:.2f}s p95={total['p95']:.2f}s over {total['count']} answers"
+
+
+def stats_report():
+    report = metrics.format_summary(pipeline.STAGES)
+    report += f"\n\nin flight={admission.in_flight}, queued={len(admission)}, sessions={len(sessions)}"
+    if worker_pool is not None:
+        # The caches live in the workers; their hits show up in the counters above
+        report += f"\nworkers: {worker_pool.ready()} ready of {worker_pool.alive()} running"
+        return report
+    if pipeline.answer_cache is not None:
+        report += f"\nanswer cache: {pipeline.answer_cache.stats()}"
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        cache = embedding_cache.stats()
+        report += f"\nembedding cache: hit rate {cache['hit_rate']:.0%}, misses {cache['misses']}"
+    return report
+
+
+async def export_metrics_periodically():
+    while True:
+        await asyncio.sleep(config.metrics_export_interval)
+        try:
+            extra = {"gauges": pipeline_stats()}
+            await run_bookkeeping(metrics.export, config.metrics_path, extra)
+        except Exception as e:
+            print("Could not export metrics:", e)
+
+
+async def evict_idle_sessions_periodically():
+    while True:
+        await asyncio.sleep(60)
+        evicted = await run_bookkeeping(sessions.evict_idle)
+        if evicted:
+            print(f"Evicted {evicted} idle sessions")
+
+
+def answer_events(user_question, formatted_conversation, sources=None):
+    """pipeline.answer_events, from a worker process in supervisor mode or the executor otherwise"""
+    if worker_pool is not None:
+        return worker_pool.answer(user_question, formatted_conversation, config.stream_responses, sources)
+    return stream_blocking(pipeline.answer_events, user_question, formatted_conversation, config.stream_responses,
+                           sources)
+
+
+async def answer_question(message, user_question, sources=None):
+    """
+    Answers a question in the message's channel, once admission lets it through
+
+    Raises:
+        Shed: the question was turned away (see admission.py)
+    """
+    priority = admission.check_user(message.author.id)
+    started = time.perf_counter()
+    session = await run_bookkeeping(sessions.get, message.channel.id, message.author.id)
+    formatted_conversation = await run_bookkeeping(sessions.format_history, session)
+
+    key = coalesce_key(user_question, sources, formatted_conversation) if config.coalesce_questions else None
+    shared = admission.in_flight_answer(key)
+    if shared is not None:
+        # Someone else asked the same thing a moment ago; reuse their answer instead of asking Claude twice
+        metrics.count("coalesced")
+        answer, session.last_query_data = await asyncio.shield(shared)
+        with metrics.span("send"):
+            await send_long(message.channel, answer)
+    else:
+        leader = admission.lead(key)
+        try:
+            answer = await generate_reply(message, user_question, formatted_conversation, session, sources,
+                                          priority, started)
+        except BaseException as e:
+            admission.finish(key, leader, error=e)
+            raise
+        admission.finish(key, leader, (answer, session.last_query_data))
+
+    await run_bookkeeping(sessions.add_turn, session, user_question, answer or "")
+
+    metrics.count("answered")
+    metrics.observe("total", time.perf_counter() - started, unit="seconds")
+    print(f"Answered in {time.perf_counter() - started:.2f}s "
+          f"(in flight: {admission.in_flight}, queued: {len(admission)}, {latency_summary()})")
+
+
+async def generate_reply(message, user_question, formatted_conversation, session, sources, priority, started):
+    """Runs the pipeline in an answering slot and streams or sends its answer; returns the answer text"""
+    async with admission.slot(priority):
+        metrics.observe("queue_wait", time.perf_counter() - started, unit="seconds")
+        answer = None
+        reply = None
+        async for kind, value in answer_events(user_question, formatted_conversation, sources):
+            if kind == "context":
+                # Store results for reuse by /show_context
+                session.last_query_data = value
+            elif kind == "chunk":
+                if reply is None:
+                    reply = StreamingReply(message.channel, edit_interval=config.stream_edit_interval)
+                await reply.add(value)
+            else:  # "cached" or "answer": the whole text at once
+                answer = value
+                with metrics.span("send"):
+                    await send_long(message.channel, answer)
+        if reply is not None:
+            with metrics.span("send"):
+                answer = await reply.finish()
+            if reply.first_token_at is not None:
+                metrics.observe("first_token", reply.first_token_at - started, unit="seconds")
+    return answer
+
+
+def busy_reply(shed):
+    if shed.reason == "user_rate":
+        return f"⏳ You're asking faster than I can answer. Try again in {max(1, round(shed.retry_after or 0))}s."
+    return "⏳ I'm busy answering other questions right now. Please try again in a minute."
+
+
+background_tasks = set()
+
+
+async def warm_up():
+    started = time.perf_counter()
+    try:
+        await run_blocking(pipeline.warm_up)
+        print(f"Warmed up in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print("Warm-up failed, questions will load what they need:", e)
 
-conversation_history = []
-last_user_question = {"text": None}  # use a mutable dict so you can update it inside the event
-last_query_data = {
-    "question": None,
-    "top_threads": None,
-    "formatted_history": None,
-    "z_scores": None,
-    "cosine_scores": None,
-    "gap": None,
-}
 
 @client.event
 async def on_ready():
     print(f"Bot is online as {client.user}")
+    # on_ready fires again after reconnects; only start the background jobs once
+    if not background_tasks:
+        connected_at = time.perf_counter()
+        metrics.observe("startup_import", imported_at - process_started, unit="seconds")
+        metrics.observe("startup_connect", connected_at - imported_at, unit="seconds")
+        print(f"Started in {connected_at - process_started:.2f}s "
+              f"(imports {imported_at - process_started:.2f}s, connect {connected_at - imported_at:.2f}s)")
+        jobs = [export_metrics_periodically, evict_idle_sessions_periodically]
+        if worker_pool is None:
+            jobs.append(warm_up)  # workers warm themselves up
+        for job in jobs:
+            background_tasks.add(asyncio.create_task(job()))
 
 @client.event
 async def on_message(message):
     if message.author == client.user:
         return
 
-    if message.channel.id != channel:
-        return# Ignore messages not from the allowed channel
+    if config.allowed_channel_ids is not None and message.channel.id not in config.allowed_channel_ids:
+        return  # Ignore messages not from the allowed channels
 
     try:
         user_input = message.content.strip().lower()
 
         if user_input == "/show_context":
-            if not last_query_data["formatted_history"]:
+            last_query_data = (await run_bookkeeping(sessions.get, message.channel.id, message.author.id)).last_query_data
+            if not last_query_data or not last_query_data["formatted_history"]:
                 await message.channel.send("⚠️ No recent question to show context for.")
                 return
 
-            debug_output = f"Auto Z-Score Threshold Based on Dropoff\n\n"
+            debug_output = "Auto Z-Score Threshold Based on Dropoff\n\n"
             debug_output += f"Largest gap = {last_query_data['gap']:.2f}\n"
-            debug_output += f"Keeping top {len(last_query_data['top_threads'])} threads\n\n"
+            debug_output += f"Keeping top {len(last_query_data['top_threads'])} threads\n"
+            if last_query_data.get("partitions") is not None:
+                debug_output += f"Searched {', '.join(last_query_data['partitions'])}\n"
+            debug_output += "\n"
 
-            for idx, cos_sim, z in last_query_data["top_threads"]:
-                debug_output += f"• {id_map[idx]} | z={z:.2f} | cos_sim={cos_sim:.3f}\n"
+            for thread_id, (idx, cos_sim, z) in zip(last_query_data["thread_ids"], last_query_data["top_threads"]):
+                debug_output += f"• {thread_id} | z={z:.2f} | score={cos_sim:.3f}\n"
 
             debug_output += "\n\nFormatted Context Sent to Claude:\n\n"
             debug_output += last_query_data["formatted_history"]
@@ -100,131 +279,52 @@ async def on_message(message):
             await message.channel.send(f"```{debug_output[:1950]}```")
             return
 
+        if user_input == "/stats":
+            await message.channel.send(f"```{stats_report()[:1950]}```")
+            return
+
+        # --- Course material only ---
+        if user_input.startswith("/course"):
+            user_question = message.content.strip()[len("/course"):].strip()
+            if not user_question:
+                await message.channel.send("Ask a question after /course, e.g. `/course how do I set up AutoDS?`")
+                return
+            print(f"New course question: {user_question}")
+            await answer_question(message, user_question, sources=config.course_sources)
+            return
+
         # --- REAL QUESTION: Run new embedding and match ---
         user_question = message.content.strip()
         print(f"New user question: {user_question}")
 
-        query_emb = generate_titan_vector_embedding(user_question).reshape(1, -1)
-        query_emb = query_emb / np.linalg.norm(query_emb)
-
-        print("Calculating cosine similarity")
-        cosine_scores = cosine_similarity(query_emb, embeddings)[0]
-        top_k = 20
-        top_indices = np.argsort(cosine_scores)[::-1][:top_k]
-
-        z_scores = calculate_zscores(cosine_scores[top_indices])
-
-        sorted_z = sorted(zip(top_indices, cosine_scores[top_indices], z_scores), key=lambda x: x[2], reverse=True)
-        max_gap, best_cutoff_idx = 0, 0
-        for i in range(1, len(sorted_z)):
-            gap = sorted_z[i - 1][2] - sorted_z[i][2]
-            if gap > max_gap:
-                max_gap = gap
-                best_cutoff_idx = i
-        top_threads = sorted_z[:best_cutoff_idx]
-
-        print(f"Using top {len(top_threads)} threads (dropoff at gap = {max_gap:.2f})")
-
-        filtered_threads = []
-        for idx, cos_sim, z in top_threads:
-            thread_id = id_map[idx]
-            conn = sqlite3.connect("data/threads.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT header, content FROM threads WHERE id = ?", (thread_id,))
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                filtered_threads.append((result[0], result[1]))
-
-        formatted_history = "\n\n".join([f"Closest Q: {header}\nA: {content}" for header, content in filtered_threads])
-
-        # Store results for reuse by /show_context
-        last_query_data["question"] = user_question
-        last_query_data["top_threads"] = top_threads
-        last_query_data["z_scores"] = z_scores
-        last_query_data["cosine_scores"] = cosine_scores[top_indices]
-        last_query_data["gap"] = max_gap
-        last_query_data["formatted_history"] = formatted_history
-
-        formatted_conversation = ""
-        for turn in conversation_history[-5:]: 
-            formatted_conversation += f"User: {turn['question']}\nAssistant: {turn['answer']}\n"
-
-
-        # --- Prompt to Claude ---
-        rag_prompt = f"""
-<Role>
-You are an expert in helping complete beginners become successful dropshippers. You specialize in: Product Research, Website Overview and Customization, Sourcing and Suppliers, TRUST Dropshipping Group, Mindset, Organic Advertising, Paid Advertising, Shopify Apps
-You have learned from an 8-hour course by Mike and Dom, as well as the Study Dropshipping Discord community FAQ threads. You speak clearly, simply, and with enthusiasm, always aiming to help users understand and succeed. You are capable of: Guiding users to their goals, explaining concepts without skipping key details, diving deeper if asked, providing examples when relevant. 
-</Role>
-
-<Task Flow>
-When a user asks a question:
-Retrieve relevant information from the internal knowledge base (course material or Discord).
-
-Answer the user’s question step-by-step, as clearly as possible. Include only the response section when you print to the customer:
-<information> (facts pulled from course/FAQ) </information>  
-<goal> (what the user is trying to accomplish) </goal>  
-<difficulty> (how hard or easy this task is) </difficulty> 
-<response> (what the user will see based on the steps above, make depth based on difficulty)</response>
-
-Include only the response section when you print to the customer.
-</Task Flow>
-
-<Business Specifics>
-Your ultimate goal is to help users move forward in their dropshipping journey—ideally to the point where they: Sign up for a Shopify trial using the company’s affiliate link, and then start a paid subscription. 
-By making the process simple, clear, and motivating, you increase the chance that users will become successful dropshippers and long-term subscribers. 
-</Business Specifics>
-
-<Examples>
-Q: How do I choose a winning product?
-A:
- <information>
- Winning products usually share a few characteristics:
-- They're easy to make eye-catching videos for (think: “TikTok-worthy”).
-- They spark emotional reactions—especially controversy or surprise.
-- They solve a problem or make life easier.
- </information>
-<goal> To identify a product that will perform well in ads and convert customers. </goal>
-<difficulty> Medium – Requires practice and testing, but tools and examples help. </difficulty>
-<response> Great question — picking the right product is one of the biggest steps in getting traction with dropshipping.
-Start by looking for products that catch attention fast. Ask yourself: Would this stop me from scrolling on TikTok or Instagram? Products that are visually interesting, solve a real problem, or stir some emotion (like surprise or controversy) tend to perform the best in ads.
-Next, think about how unique the product feels. If it’s already everywhere, it’ll be tough to stand out. And finally, check the numbers — look for something you can sell for 3x what it costs you to source.
-It might take a few tries to land on the right one, but with research tools and inspiration from what’s already working for others, you’ll be able to spot the patterns.
-Want help brainstorming or validating a product you’re thinking about?
-</response>
-</Examples>
-
-<Conversation History>
-{formatted_conversation}
-</Conversation History>
-
-<User Question and Information from database>
-A user just asked this question:
-"{user_question}"
-
-Relevant Threads:
-{formatted_history}
-</User Question and Information from database>
-
-
-<Reiteration>
-You are a friendly, professional dropshipper who wants to grow the community through free, helpful, and clear advice. Be excited to help, break things down step-by-step, and always aim to get the user closer to taking action.
-Only return the <response> without the tags. Make sure the message sent to discord is less than 2000 characters.
-</Reiteration>
-"""  
-        print("Calling Claude")
-        claude_response = llm.invoke(rag_prompt)
-
-        await message.channel.send(claude_response.content.strip())
-
-        conversation_history.append({
-            "question": user_question,
-            "answer": claude_response.content.strip()
-        })
+        await answer_question(message, user_question)
+
+    except Shed as e:
+        print(f"Turned away a question from {message.author.id}: {e.reason}")
+        await message.channel.send(busy_reply(e))
 
     except Exception as e:
+        metrics.count("failed")
         print("ERROR:", e)
-        await message.channel.send("Something went wrong.")
-
-client.run(discord_token)
+        if is_throttling(e):
+            # Bedrock is over its quota: the user can simply ask again shortly
+            metrics.count("bedrock_throttled")
+            await message.channel.send(busy_reply(Shed("throttled")))
+        else:
+            await message.channel.send("Something went wrong.")
+
+
+if __name__ == "__main__":
+    if config.index_check == "strict":
+        pipeline.check_consistency()  # refuse to start before connecting rather than after
+    if config.bot_workers > 0:
+        from workers import WorkerPool
+        worker_pool = WorkerPool(config.bot_workers, config.worker_threads, metrics)
+        worker_pool.start()
+        # Let every worker thread have a question; MAX_IN_FLIGHT_QUESTIONS sizes the in-process mode
+        admission.slots = config.bot_workers * config.worker_threads
+    try:
+        client.run(config.discord_token)
+    finally:
+        if worker_pool is not None:
+            worker_pool.stop()
@@ -0,0 +1,149 @@
+import os
+from dotenv import load_dotenv
+
+# --- Environment & Keys ---
+load_dotenv()
+discord_token = os.getenv("DISCORD_TOKEN")
+aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
+aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+aws_region = os.getenv("AWS_DEFAULT_REGION")
+# Channels the bot answers in, comma-separated; "*" for every channel it can see
+allowed_channel_ids = os.getenv("ALLOWED_CHANNEL_IDS", "1375597403750797493")
+allowed_channel_ids = None if allowed_channel_ids.strip() == "*" else {
+    int(channel_id) for channel_id in allowed_channel_ids.split(",") if channel_id.strip()
+}
+
+# --- Request pipeline ---
+# Questions answered at the same time; extra questions wait their turn
+max_in_flight_questions = int(os.getenv("MAX_IN_FLIGHT_QUESTIONS", "4"))
+# Recent samples kept per stage for the latency percentiles
+metrics_window = int(os.getenv("METRICS_WINDOW", "1000"))
+# Where the bot writes its metrics summary, and how often
+metrics_path = os.getenv("METRICS_PATH", "data/metrics.json")
+metrics_export_interval = float(os.getenv("METRICS_EXPORT_INTERVAL", "30"))
+# Supervisor mode: answer questions in this many worker processes (0 answers in the bot process)
+bot_workers = int(os.getenv("BOT_WORKERS", "0"))
+# Questions each worker process answers at once
+worker_threads = int(os.getenv("WORKER_THREADS", "4"))
+
+# --- Admission control ---
+# Questions waiting for a free slot; past this the bot replies "busy, try again" (0 for no limit)
+max_queued_questions = int(os.getenv("MAX_QUEUED_QUESTIONS", "50"))
+# Questions one user may ask per minute, and at once after a quiet spell; 0 for no limit
+user_questions_per_minute = float(os.getenv("USER_QUESTIONS_PER_MINUTE", "6"))
+user_question_burst = int(os.getenv("USER_QUESTION_BURST", "3"))
+# Questions started per second across all users, to stay under the Bedrock quotas; 0 for no limit
+global_questions_per_second = float(os.getenv("GLOBAL_QUESTIONS_PER_SECOND", "5"))
+global_question_burst = int(os.getenv("GLOBAL_QUESTION_BURST", "10"))
+# A user's question this soon after their last one waits behind other users' first questions
+follow_up_seconds = float(os.getenv("FOLLOW_UP_SECONDS", "60"))
+# Identical questions asked while the first is still being answered share its answer
+coalesce_questions = os.getenv("COALESCE_QUESTIONS", "1") == "1"
+
+# --- Thread store ---
+threads_db_path = os.getenv("THREADS_DB_PATH", "data/threads.db")
+# Q&A threads load_data.py embeds: what discordQASummerizer.py writes by default (its --output)
+qa_threads_path = os.getenv("QA_THREADS_PATH", "../qa_threads.json")
+thread_store_pool_size = int(os.getenv("THREAD_STORE_POOL_SIZE", str(max_in_flight_questions)))
+# Load the whole threads table into memory at startup
+thread_store_in_memory = os.getenv("THREAD_STORE_IN_MEMORY", "0") == "1"
+
+# --- Vector index ---
+# "numpy" scans models/embeddings.npy exactly, "two_stage" scans the store's coarse copy
+# and rescores the best candidates exactly, "faiss" opens the index built by load_data.py
+index_backend = os.getenv("INDEX_BACKEND", "numpy")
+embeddings_path = os.getenv("EMBEDDINGS_PATH", "models/embeddings.npy")
+id_map_path = os.getenv("ID_MAP_PATH", "models/id_map.txt")
+faiss_index_path = os.getenv("FAISS_INDEX_PATH", "models/faiss_index.index")
+# Compact memory-mapped store; the bot prefers it over embeddings.npy when present.
+# Older load_data.py runs wrote these; newer ones publish snapshots (below) instead
+embedding_store_dir = os.getenv("EMBEDDING_STORE_DIR", "models/store")
+# Used by load_data.py when writing the store: float32, float16 or int8
+# (see benchmarks/bench_store.py for the recall and speed of each)
+embedding_store_dtype = os.getenv("EMBEDDING_STORE_DTYPE", "float32")
+# Used by load_data.py: coarse copy for the two_stage backend, none, int8 or pca
+# (the EMBEDDING_STORE_COARSE_DIMS leading directions)
+embedding_store_coarse = os.getenv("EMBEDDING_STORE_COARSE", "none")
+embedding_store_coarse_dims = int(os.getenv("EMBEDDING_STORE_COARSE_DIMS", "128"))
+# Rows the two_stage backend rescores with the full vectors (see benchmarks/bench_two_stage.py)
+two_stage_candidates = int(os.getenv("TWO_STAGE_CANDIDATES", "100"))
+# Used by load_data.py when building the FAISS index: flat, ivf or hnsw
+faiss_index_type = os.getenv("FAISS_INDEX_TYPE", "flat")
+faiss_nprobe = int(os.getenv("FAISS_NPROBE", "8"))
+faiss_ef_search = int(os.getenv("FAISS_EF_SEARCH", "64"))
+retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", "20"))
+# Check that the index, its id map and threads.db line up: warn (print the problems
+# during the background warm-up), strict (refuse to start, checked before connecting) or off
+index_check = os.getenv("INDEX_CHECK", "warn")
+# load_data.py publishes each re-index here as a versioned snapshot (see snapshots.py);
+# the bot only reads the index, id map, store and threads.db paths above until the first one exists
+snapshot_dir = os.getenv("SNAPSHOT_DIR", "models/snapshots")
+# How often the bot looks for a newly published snapshot, in seconds; 0 to never swap without a restart
+snapshot_poll_interval = float(os.getenv("SNAPSHOT_POLL_INTERVAL", "30"))
+# Snapshots load_data.py keeps on disk, including the current one
+snapshot_keep = int(os.getenv("SNAPSHOT_KEEP", "3"))
+
+# --- Partitioned search ---
+# off: one search over everything, all: search every category with scores normalized
+# per category (see partitions.py), classify: search only the categories the question's
+# keywords point to. Neither partitioned mode has beaten the flat search on this corpus:
+# all scans every row anyway and classify misses threads filed under another category, so
+# run benchmarks/eval_retrieval.py against "off" before switching
+partition_mode = os.getenv("PARTITION_MODE", "off")
+# classify searches every category after all when fewer than this many hits reach RETRIEVAL_MIN_SCORE
+partition_min_hits = int(os.getenv("PARTITION_MIN_HITS", "3"))
+# Sources /course answers from, comma-separated (load_data.py records each thread's source)
+course_sources = {source.strip() for source in os.getenv("COURSE_SOURCES", "course").split(",") if source.strip()}
+
+# --- Relevance filter ---
+# dropoff (largest z-score gap), threshold (fixed cosine floor) or mmr (diversity rerank)
+retrieval_strategy = os.getenv("RETRIEVAL_STRATEGY", "dropoff")
+retrieval_min_score = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.5"))
+retrieval_max_threads = int(os.getenv("RETRIEVAL_MAX_THREADS", "5"))
+mmr_diversity = float(os.getenv("MMR_DIVERSITY", "0.3"))
+# At most this many threads from one category; 0 for no cap
+retrieval_max_per_category = int(os.getenv("RETRIEVAL_MAX_PER_CATEGORY", "0"))
+
+# --- Keyword (BM25) search ---
+# fuse: embedding and keyword hits merged; lexical_first: skip Titan when keywords
+# alone find a strong match; off: embeddings only
+hybrid_mode = os.getenv("HYBRID_MODE", "fuse")
+# weighted (cosine blended with BM25 scaled to the best keyword hit) keeps scores on
+# the cosine scale the dropoff cutoff was tuned on; rrf (reciprocal rank fusion)
+# ignores score scales but flattens them, so pair it with the threshold strategy
+hybrid_fusion = os.getenv("HYBRID_FUSION", "weighted")
+hybrid_lexical_weight = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+hybrid_rrf_k = int(os.getenv("HYBRID_RRF_K", "60"))
+# BM25 score the best keyword hit needs for lexical_first to skip the embedding
+hybrid_lexical_min_score = float(os.getenv("HYBRID_LEXICAL_MIN_SCORE", "12.0"))
+
+# --- Context packing ---
+# Estimated tokens all retrieved threads together may add to the prompt; 0 for no limit
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Estimated tokens for the whole prompt: the fixed instructions and examples, the conversation
+# and the question come first, and the threads get what is left (at most CONTEXT_TOKEN_BUDGET); 0 for no limit
+prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Any one thread longer than this is cut to its passages closest to the question; 0 for no limit
+context_max_thread_tokens = int(os.getenv("CONTEXT_MAX_THREAD_TOKENS", "1200"))
+
+# --- Answer cache ---
+answer_cache_enabled = os.getenv("ANSWER_CACHE", "1") == "1"
+# Cosine similarity a new question needs to an answered one to reuse its answer
+answer_cache_threshold = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+answer_cache_ttl = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+answer_cache_max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+
+# --- Streaming replies ---
+# Post Claude's answer as it is generated instead of after it finishes
+stream_responses = os.getenv("STREAM_RESPONSES", "1") == "1"
+# Seconds between edits of the streamed message; Discord allows about 5 edits per 5s per channel
+stream_edit_interval = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# --- Conversation memory ---
+session_max_turns = int(os.getenv("SESSION_MAX_TURNS", "5"))
+# Estimated tokens of past turns allowed in the prompt
+session_history_tokens = int(os.getenv("SESSION_HISTORY_TOKENS", "1500"))
+session_idle_seconds = float(os.getenv("SESSION_IDLE_SECONDS", "3600"))
+session_max_active = int(os.getenv("SESSION_MAX_ACTIVE", "10000"))
+# Empty to keep conversations in memory only
+session_db_path = os.getenv("SESSION_DB_PATH", "data/sessions.db")
@@ -0,0 +1,41 @@
+def check_index(id_map, vector_index, thread_store):
+    """
+    Checks that the vectors, their id map and threads.db describe the same threads
+
+    Linear in the number of threads and reads only ids, never content, so it
+    is cheap enough for every startup.
+
+    Args:
+        id_map (Sequence[str]): thread id per vector row
+        vector_index: NumpyIndex or FaissIndex
+        thread_store (ThreadStore): where the bot fetches thread text from
+
+    Return:
+        List[str]: problems found; empty when everything lines up
+    """
+    problems = []
+    if len(id_map) != len(vector_index):
+        problems.append(f"id map has {len(id_map)} ids but the index has {len(vector_index)} vectors")
+
+    seen, duplicates = set(), set()
+    for thread_id in id_map:
+        if thread_id in seen:
+            duplicates.add(thread_id)
+        seen.add(thread_id)
+    if duplicates:
+        problems.append(f"{len(duplicates)} ids appear more than once in the id map, e.g. {sorted(duplicates)[:3]}")
+
+    missing = seen - thread_store.ids()
+    if missing:
+        problems.append(f"{len(missing)} ids in the id map are not in threads.db, e.g. {sorted(missing)[:3]}")
+    return problems
+
+
+def report_index_problems(problems, mode="warn"):
+    """Prints what check_index found; in "strict" mode a mismatch stops the bot instead"""
+    if not problems:
+        return
+    message = "Index is out of sync with threads.db (re-run load_data.py):\n  " + "\n  ".join(problems)
+    if mode == "strict":
+        raise RuntimeError(message)
+    print(f"Warning: {message}")
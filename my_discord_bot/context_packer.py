@@ -0,0 +1,118 @@
+import re
+from sessions import estimate_tokens
+from thread_store import STOPWORDS
+
+# Course transcripts are long runs of sentences with no paragraph breaks, so
+# oversized threads are cut into windows of whole sentences about this long
+PASSAGE_TOKENS = 120
+
+# Marks where passages of a trimmed thread were left out
+ELLIPSIS = " [...] "
+
+
+def query_terms(text):
+    """Lower-cased content words of the question"""
+    return {term for term in re.findall(r"\w+", text.lower()) if len(term) > 1 and term not in STOPWORDS}
+
+
+def format_thread(header, content):
+    return f"Closest Q: {header}\nA: {content}"
+
+
+def split_passages(content, passage_tokens=PASSAGE_TOKENS):
+    """Splits text into runs of whole sentences of roughly passage_tokens each, in order"""
+    passages, current, used = [], [], 0
+    for line in content.splitlines():
+        for sentence in re.split(r"(?<=[.!?])\s+", line.strip()):
+            if not sentence:
+                continue
+            tokens = estimate_tokens(sentence)
+            if current and used + tokens > passage_tokens:
+                passages.append(" ".join(current))
+                current, used = [], 0
+            current.append(sentence)
+            used += tokens
+        if current:  # never join across a line break
+            passages.append(" ".join(current))
+            current, used = [], 0
+    return passages
+
+
+def best_passages(content, terms, budget_tokens):
+    """
+    The passages of content that share the most words with the question and fit the budget
+
+    Args:
+        content (str): thread text too long to include whole
+        terms (Set[str]): query_terms of the question
+        budget_tokens (int): tokens the kept passages may use
+
+    Return:
+        str: kept passages in their original order, or "" if none fits
+    """
+    passages = split_passages(content)
+    scored = []
+    for position, passage in enumerate(passages):
+        words = set(re.findall(r"\w+", passage.lower()))
+        scored.append((len(terms & words), -position))
+    # Most overlap first; among equals, earlier passages (the thread usually opens with its point)
+    ranking = sorted(range(len(passages)), key=lambda i: scored[i], reverse=True)
+
+    kept, used = [], estimate_tokens(ELLIPSIS)
+    for i in ranking:
+        tokens = estimate_tokens(passages[i]) + estimate_tokens(ELLIPSIS)
+        if used + tokens > budget_tokens:
+            continue
+        kept.append(i)
+        used += tokens
+    if not kept:
+        return ""
+
+    kept.sort()
+    text = passages[kept[0]] if kept[0] == 0 else ELLIPSIS.lstrip() + passages[kept[0]]
+    for previous, i in zip(kept, kept[1:]):
+        text += (" " if i == previous + 1 else ELLIPSIS) + passages[i]
+    if kept[-1] != len(passages) - 1:
+        text += ELLIPSIS.rstrip()
+    return text
+
+
+def pack_threads(threads, question, budget_tokens, max_thread_tokens=0):
+    """
+    Formats the retrieved threads for the prompt within a token budget
+
+    Threads go in rank order. One that does not fit the room left (or is
+    longer than max_thread_tokens) is cut down to its passages that best
+    match the question; packing stops at the first thread nothing of which
+    fits.
+
+    Args:
+        threads (List[Tuple[str, str]]): (header, content) best first
+        question (str): the user's question, to pick passages by
+        budget_tokens (int): tokens for all threads together; 0 for no limit
+        max_thread_tokens (int): tokens for any one thread; 0 for no limit
+
+    Return:
+        Tuple[str, int, int]: (formatted threads, estimated tokens, number of threads trimmed)
+    """
+    terms = query_terms(question)
+    blocks, used, trimmed = [], 0, 0
+    separator = estimate_tokens("\n\n")
+    for header, content in threads:
+        room = budget_tokens - used - (separator if blocks else 0) if budget_tokens else None
+        if max_thread_tokens:
+            room = max_thread_tokens if room is None else min(room, max_thread_tokens)
+
+        block = format_thread(header, content)
+        tokens = estimate_tokens(block)
+        if room is not None and tokens > room:
+            content = best_passages(content, terms, room - estimate_tokens(format_thread(header, "")))
+            if not content:
+                break
+            block = format_thread(header, content)
+            tokens = estimate_tokens(block)
+            trimmed += 1
+
+        used += tokens + (separator if blocks else 0)
+        blocks.append(block)
+    return "\n\n".join(blocks), used, trimmed
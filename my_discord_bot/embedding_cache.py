@@ -0,0 +1,111 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def cache_key(model_id, dimensions, normalize, text):
+    """Same text embedded with a different model or settings is a different vector"""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model_id}|{dimensions}|{int(bool(normalize))}|{digest}"
+
+
+class EmbeddingCache(object):
+    """
+    Two-level embedding cache: an in-process LRU in front of a SQLite file.
+
+    The SQLite file is shared by the bot and load_data.py, so a question the
+    bot has already seen, or a re-run of the loader, does not pay for the same
+    Titan call twice. Safe to use from several threads.
+    """
+
+    def __init__(self, path="data/embedding_cache.db", memory_size=1024, max_disk_entries=100000):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_disk_entries = max_disk_entries
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")  # bot and loader can use it at the same time
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB,
+                last_used REAL
+            )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._conn.commit()
+            # Upper bound on rows (replacing a key still counts); recounted before evicting
+            self._disk_count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return vector
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    self._conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._conn.commit()
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.counters["disk_hits"] += 1
+                    return vector
+
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, vector):
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)  # handed out to every later caller
+        with self._lock:
+            self._remember(key, vector)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    (key, vector.tobytes(), time.time()),
+                )
+                self._disk_count += 1
+                if self._disk_count > self.max_disk_entries:
+                    self._evict_disk()
+                self._conn.commit()
+        return vector
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._disk_count = count
+        if count <= self.max_disk_entries:
+            return
+        # Drop a tenth of the limit at once so eviction does not run on every put
+        excess = count - self.max_disk_entries + max(1, self.max_disk_entries // 10)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self.counters["evictions"] += excess
+        self._disk_count -= excess
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
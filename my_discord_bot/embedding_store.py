@@ -0,0 +1,167 @@
+import json
+import os
+import numpy as np
+
+# On-disk layout written by load_data.py and memory-mapped by the bot:
+#   manifest.json  dtype, row count, dimensions
+#   vectors.npy    (N, D) float32, float16 or int8
+#   scales.npy     (N,) float32 per-row scale factors, int8 only
+#   ids.npy        (N,) fixed-width UTF-8 byte strings
+#   coarse.npy     optional small copy of the vectors for two-stage search:
+#                  (N, D) int8 with coarse_scales.npy, or (N, d) float32
+#                  projected onto the d leading directions in projection.npy (D, d)
+# Every bot process maps the same files, so they share one copy in the page
+# cache and opening the store costs the same at 600 rows or 6 million.
+
+STORE_DTYPES = ("float32", "float16", "int8")
+COARSE_TYPES = ("none", "int8", "pca")
+
+
+def quantize(embeddings, dtype):
+    """
+    Converts normalized float embeddings to the store's dtype
+
+    Return:
+        Tuple[np.ndarray, np.ndarray]: (vectors, per-row scales or None)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype in ("float32", "float16"):
+        return embeddings.astype(dtype), None
+    if dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        vectors = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return vectors, scales.astype(np.float32)
+    raise ValueError(f"Unknown store dtype {dtype!r}, expected one of {STORE_DTYPES}")
+
+
+def principal_directions(embeddings, dims, sample_rows=20000, seed=0):
+    """
+    The dims directions that keep the most of the vectors' inner products
+
+    Right singular vectors of (a sample of) the uncentered embedding matrix,
+    so projecting both the vectors and a query onto them approximates the
+    cosine scores the full vectors give.
+
+    Return:
+        np.ndarray: (D, dims) float32 with orthonormal columns
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if len(embeddings) > sample_rows:
+        rows = np.random.default_rng(seed).choice(len(embeddings), sample_rows, replace=False)
+        embeddings = embeddings[rows]
+    _, _, directions = np.linalg.svd(embeddings, full_matrices=False)
+    return np.ascontiguousarray(directions[:dims].T, dtype=np.float32)
+
+
+def coarse_vectors(embeddings, coarse, coarse_dims=128):
+    """
+    The small copy of the embeddings two-stage search scans first
+
+    Return:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (vectors, per-row scales or None, projection or None)
+    """
+    if coarse == "int8":
+        vectors, scales = quantize(embeddings, "int8")
+        return vectors, scales, None
+    if coarse == "pca":
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        projection = principal_directions(embeddings, min(coarse_dims, embeddings.shape[1]))
+        return np.ascontiguousarray(embeddings @ projection), None, projection
+    raise ValueError(f"Unknown coarse type {coarse!r}, expected one of {COARSE_TYPES}")
+
+
+class IdTable(object):
+    """Read-only list of thread ids backed by a packed byte-string array"""
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __getitem__(self, position):
+        return self.packed[position].decode("utf-8")
+
+    def __iter__(self):
+        return (value.decode("utf-8") for value in self.packed)
+
+
+class EmbeddingStore(object):
+    def __init__(self, directory, manifest, vectors, scales, ids, coarse=None, coarse_scales=None, projection=None):
+        self.directory = directory
+        self.manifest = manifest
+        self.vectors = vectors
+        self.scales = scales
+        self.ids = ids
+        self.coarse = coarse
+        self.coarse_scales = coarse_scales
+        self.projection = projection
+
+    @property
+    def dtype(self):
+        return self.manifest["dtype"]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def write_store(directory, embeddings, ids, dtype="float32", coarse="none", coarse_dims=128):
+    """
+    Writes the store, plus the coarse copy two-stage search needs unless coarse is "none"
+
+    Args:
+        coarse (str): "int8" (same dimensions, a quarter of float32's bytes) or
+            "pca" (coarse_dims leading directions, float32 so the scan stays one BLAS call)
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors, scales = quantize(embeddings, dtype)
+    encoded = [str(thread_id).encode("utf-8") for thread_id in ids]
+    width = max((len(value) for value in encoded), default=1)
+
+    np.save(os.path.join(directory, "vectors.npy"), vectors)
+    np.save(os.path.join(directory, "ids.npy"), np.array(encoded, dtype=f"S{width}"))
+    if scales is not None:
+        np.save(os.path.join(directory, "scales.npy"), scales)
+
+    manifest = {"dtype": dtype, "count": int(vectors.shape[0]), "dimensions": int(vectors.shape[1]) if vectors.ndim == 2 else 0}
+    if coarse != "none" and len(vectors):
+        small, small_scales, projection = coarse_vectors(embeddings, coarse, coarse_dims)
+        np.save(os.path.join(directory, "coarse.npy"), small)
+        if small_scales is not None:
+            np.save(os.path.join(directory, "coarse_scales.npy"), small_scales)
+        if projection is not None:
+            np.save(os.path.join(directory, "projection.npy"), projection)
+        manifest["coarse"] = {"type": coarse, "dimensions": int(small.shape[1])}
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def store_exists(directory):
+    return os.path.exists(os.path.join(directory, "manifest.json"))
+
+
+def open_store(directory):
+    """Memory-maps a store written by write_store; nothing is read until it is searched"""
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    ids = IdTable(np.load(os.path.join(directory, "ids.npy"), mmap_mode="r"))
+    scales = None
+    if manifest["dtype"] == "int8":
+        scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r")
+
+    coarse = coarse_scales = projection = None
+    coarse_type = manifest.get("coarse", {}).get("type")
+    if coarse_type:
+        coarse = np.load(os.path.join(directory, "coarse.npy"), mmap_mode="r")
+        if coarse_type == "int8":
+            coarse_scales = np.load(os.path.join(directory, "coarse_scales.npy"), mmap_mode="r")
+        else:
+            projection = np.load(os.path.join(directory, "projection.npy"))
+
+    if len(ids) != vectors.shape[0]:
+        raise ValueError(f"{directory}: {vectors.shape[0]} vectors but {len(ids)} ids")
+    return EmbeddingStore(directory, manifest, vectors, scales, ids, coarse, coarse_scales, projection)
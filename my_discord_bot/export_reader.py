@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import re
+
+# Bytes read from disk at a time; one message never has to fit in a single read
+READ_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+_separator = re.compile(r"[\s,]*")
+
+
+def iter_json_array(path, read_size=READ_SIZE):
+    """
+    Yields the elements of a top-level JSON array one at a time
+
+    Only the element being parsed and the unread rest of the current read are
+    held in memory, so exports of any size stream in constant memory.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(read_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} is not a JSON array")
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer[_separator.match(buffer).end():]
+            if buffer.startswith("]"):
+                return
+            try:
+                item, end = _decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element runs past what has been read so far
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+            if len(buffer) < read_size and not eof:
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer += chunk
+
+
+def iter_jsonl(path):
+    """Yields one object per non-empty line"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_records(path):
+    """Streams a JSON array or a JSONL file, going by the extension"""
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+def batched(records, size):
+    """Groups an iterable into lists of `size`; the last may be shorter"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def fingerprint(record):
+    """Stable hash of one record, to recognise it again on the next run"""
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class HighWaterMark(object):
+    """
+    How many records of an append-only export have already been processed.
+
+    Stored as a small JSON file next to the output. Besides the count it keeps
+    the fingerprint of the last processed record; if that record is no longer
+    at the same position the export was rewritten rather than appended to,
+    and everything is processed again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.processed = 0
+        self.last_fingerprint = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.processed = state.get("processed", 0)
+            self.last_fingerprint = state.get("last_fingerprint")
+
+    def new_records(self, open_records):
+        """
+        Skips the records processed on earlier runs and returns an iterator over the rest
+
+        Args:
+            open_records (callable): opens the export as an iterator of records, e.g. lambda: iter_records(path);
+                called a second time to start over when the export no longer matches the mark
+        """
+        records = open_records()
+        last = None
+        for _ in range(self.processed):
+            last = next(records, None)
+            if last is None:
+                break
+        if self.processed and (last is None or fingerprint(last) != self.last_fingerprint):
+            print(f"{self.path} does not match the export any more; processing it from the start")
+            self.processed, self.last_fingerprint = 0, None
+            return open_records()
+        return records
+
+    def advance(self, count, last_record):
+        """Marks the next `count` records after the mark, ending with last_record, as processed"""
+        if count:
+            self.processed += count
+            self.last_fingerprint = fingerprint(last_record)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"processed": self.processed, "last_fingerprint": self.last_fingerprint}, f)
+        os.replace(tmp_path, self.path)
@@ -1,28 +1,36 @@
-import json
+import argparse
+import hashlib
+import itertools
 import os
+import shutil
+import sys
+import time
 import numpy as np
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #from sentence_transformers import SentenceTransformer
-from sklearn.preprocessing import normalize
-import boto3
 from dotenv import load_dotenv
-from TitanEmbeddings import TitanEmbeddings, generate_titan_vector_embedding
+from TitanEmbeddings import (generate_titan_vector_embedding, embedding_model_name, embedding_dimensions,
+                             TITAN_DIMENSIONS, get_embedding_cache)
+from bedrock_retry import call_with_backoff
+from vector_index import build_faiss_index, save_faiss_index
+from embedding_store import write_store
+from export_reader import iter_records
+from snapshots import current_version, publish, prune
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "video_chunking"))
+from script_to_json import chunk_directory, load_config as load_chunk_config
+import config
 
 load_dotenv()
-aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
-aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-aws_region = os.getenv("AWS_DEFAULT_REGION")
 
-aws_client = boto3.client(
-    "bedrock-runtime",
-    region_name=aws_region,
-    aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key
-)
+# Ids and source of the summarized Discord threads, kept whatever the summarizer's
+# output file is called so re-pointing QA_THREADS_PATH doesn't re-embed them all
+DISCORD_NAMESPACE = "general-chat"
+DISCORD_SOURCE = "general-chat.json"
 
 # Load your threads
 file_paths = [
-    "studyDropshipping/general-chat.json",
     "studyDropshipping/scripts_json_format/script_autods.json",
     "studyDropshipping/scripts_json_format/script_ch4.json",
     "studyDropshipping/scripts_json_format/script_ch7.json",
@@ -35,64 +43,375 @@ file_paths = [
 
 ]
 
-os.makedirs("models", exist_ok=True)
-os.makedirs("data", exist_ok=True)
+# Between the source file and the item's own id in threads.db ids
+ID_SEPARATOR = ":"
+
+# Titan requests in flight at once; the account's rate limit is the real ceiling
+embed_concurrency = int(os.getenv("EMBED_CONCURRENCY", "8"))
+# Print a progress line every this many embedded items
+progress_every = int(os.getenv("EMBED_PROGRESS_EVERY", "25"))
+
+
+def namespaced_id(namespace, raw_id):
+    """
+    Id of an item in threads.db: the file it came from plus its id in that file
+
+    Every course script numbers its chunks from 1, so the raw ids alone
+    collide ("script_ch4:3" and "script_ch9:3" are different chunks).
+    """
+    return f"{namespace}{ID_SEPARATOR}{raw_id}"
+
+
+def complete_items(records, default_source, namespace):
+    """Yields (thread_id, header, content, category, source) for every record that has an id, header and content"""
+    for item in records:
+        header = item.get("header") or item.get("question")
+        content = item.get("content") or item.get("full_thread_answer")
+        category = item.get("category", "Unknown")
+        source = item.get("source", default_source)
+        thread_id = item["id"]
 
-model = TitanEmbeddings(boto3_client=aws_client)
-all_embeddings = []
-id_map = []
+        if not (thread_id and content and header):
+            print(f"Skipping incomplete item: {thread_id}")
+            continue
 
-conn = sqlite3.connect("data/threads.db", timeout=10.0)  # single connection
-cursor = conn.cursor()
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS threads (
-    id TEXT PRIMARY KEY,
-    header TEXT,
-    content TEXT,
-    category TEXT,
-    source TEXT
-)
-""")
+        yield namespaced_id(namespace, thread_id), header, content, category, source
 
 
-try:
+def read_items(file_paths):
+    """complete_items of the JSON or JSONL files"""
     for file_path in file_paths:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # Streamed, so the growing Discord export is never held in memory whole
+        namespace = os.path.splitext(os.path.basename(file_path))[0]
+        yield from complete_items(iter_records(file_path), os.path.basename(file_path), namespace)
+
+
+def read_qa_threads(path):
+    """complete_items of the Q&A threads discordQASummerizer.py wrote"""
+    yield from complete_items(iter_records(path), DISCORD_SOURCE, DISCORD_NAMESPACE)
+
+
+def read_transcripts(transcript_dir, chunk_config=None):
+    """complete_items of the course transcripts in transcript_dir, chunked on the fly by script_to_json"""
+    for path, chunks in chunk_directory(transcript_dir, load_chunk_config(chunk_config)):
+        print(f"Chunked {path} into {len(chunks)} items")
+        # script_to_json ids already carry a prefix per transcript
+        yield from complete_items(chunks, "course", "transcripts")
+
+
+class Progress(object):
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.retries = 0
+        self.started = time.perf_counter()
 
-        for item in data:
-            header = item.get("header") or item.get("question")
-            content = item.get("content") or item.get("full_thread_answer")
-            category = item.get("category", "Unknown")
-            source = item.get("source", os.path.basename(file_path))
-            thread_id = item["id"]
+    def on_retry(self, attempt, error):
+        self.retries += 1
 
-            if not (thread_id and content and header):
-                print(f"Skipping incomplete item: {thread_id}")
-                continue
+    def advance(self):
+        self.done += 1
+        if self.done % progress_every == 0 or self.done == self.total:
+            elapsed = time.perf_counter() - self.started
+            rate = self.done / elapsed if elapsed else 0.0
+            remaining = (self.total - self.done) / rate if rate else 0.0
+            print(f"Embedded {self.done}/{self.total} ({rate:.1f} items/s, "
+                  f"{self.retries} throttle retries, ~{remaining:.0f}s left)")
 
-            # 💡 Avoid locking the DB while calling Titan
-            embedding = generate_titan_vector_embedding(content)
 
-            all_embeddings.append(embedding)
-            id_map.append(thread_id)
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
-            # 💾 Write to DB after embedding is ready
-            cursor.execute("""
-                INSERT OR REPLACE INTO threads (id, header, content, category, source)
-                VALUES (?, ?, ?, ?, ?)
-            """, (thread_id, header, content, category, source))
 
+def open_threads_db(path="data/threads.db"):
+    """Opens threads.db, creating the table or adding the incremental-index columns it is missing"""
+    conn = sqlite3.connect(path, timeout=10.0)  # single connection
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS threads (
+        id TEXT PRIMARY KEY,
+        header TEXT,
+        content TEXT,
+        category TEXT,
+        source TEXT
+    )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(threads)")}
+    for name, column_type in (("content_hash", "TEXT"), ("embedding_model", "TEXT"), ("embedding", "BLOB")):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE threads ADD COLUMN {name} {column_type}")
     conn.commit()
-finally:
-    conn.close()
+    return conn
+
+
+def migrate_ids(cursor, items):
+    """
+    Renames rows stored under the old un-namespaced ids, keeping their embeddings
+
+    A row is renamed when one of the items has the same raw id and the same
+    content. Rows nothing matches (chunks a later file overwrote under the old
+    scheme) are left for plan_changes to delete, and the items they shadowed
+    get embedded as new.
+
+    Return:
+        int: rows renamed
+    """
+    by_raw_id = {}
+    for thread_id, header, content, category, source in items:
+        raw_id = thread_id.split(ID_SEPARATOR, 1)[1]
+        by_raw_id.setdefault(raw_id, []).append((thread_id, content_hash(content)))
+    taken = {row[0] for row in cursor.execute("SELECT id FROM threads WHERE instr(id, ?) > 0", (ID_SEPARATOR,))}
+
+    renames = []
+    for old_id, content in cursor.execute("SELECT id, content FROM threads WHERE instr(id, ?) = 0", (ID_SEPARATOR,)):
+        stored_hash = content_hash(content or "")
+        for new_id, item_hash in by_raw_id.get(old_id, ()):
+            if item_hash == stored_hash and new_id not in taken:
+                renames.append((new_id, old_id))
+                taken.add(new_id)
+                break
+    cursor.executemany("UPDATE threads SET id = ? WHERE id = ?", renames)
+    return len(renames)
+
+
+def plan_changes(items, cursor, model_id=embedding_model_name(), full=False):
+    """
+    Compares the items against threads.db without loading any content
+
+    Return:
+        Tuple[list, list, list]: (items to embed, unchanged items, ids to delete)
+    """
+    stored = {
+        thread_id: (stored_hash, stored_model, has_embedding)
+        for thread_id, stored_hash, stored_model, has_embedding in cursor.execute(
+            "SELECT id, content_hash, embedding_model, embedding IS NOT NULL FROM threads"
+        )
+    }
+
+    to_embed, unchanged = [], []
+    for item in items:
+        thread_id, header, content, category, source = item
+        if not full and stored.get(thread_id) == (content_hash(content), model_id, 1):
+            unchanged.append(item)
+        else:
+            to_embed.append(item)
+
+    current_ids = {item[0] for item in items}
+    deleted = [thread_id for thread_id in stored if thread_id not in current_ids]
+    return to_embed, unchanged, deleted
+
+
+def embed_items(items, cursor, concurrency=embed_concurrency, dimensions=embedding_dimensions):
+    """
+    Embeds items on a bounded worker pool and writes each row as soon as its embedding is back
+
+    Args:
+        items (List[tuple]): rows from read_items
+        cursor (sqlite3.Cursor): threads.db cursor, only used from this thread
+        concurrency (int): Titan requests in flight at once
+        dimensions (int): Titan output size, 256, 512 or 1024
+    """
+    progress = Progress(len(items))
+    # Recorded next to each vector so a model or size change re-embeds everything
+    model_id = embedding_model_name(dimensions)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(call_with_backoff, generate_titan_vector_embedding, item[2], dimensions,
+                            on_retry=progress.on_retry): item
+            for item in items
+        }
+        try:
+            for future in as_completed(futures):
+                thread_id, header, content, category, source = futures[future]
+                embedding = np.asarray(future.result(), dtype=np.float32)
+
+                # 💾 Write to DB after embedding is ready
+                cursor.execute("""
+                    INSERT INTO threads (id, header, content, category, source, content_hash, embedding_model, embedding)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO UPDATE SET
+                        header = excluded.header, content = excluded.content, category = excluded.category,
+                        source = excluded.source, content_hash = excluded.content_hash,
+                        embedding_model = excluded.embedding_model, embedding = excluded.embedding
+                """, (thread_id, header, content, category, source, content_hash(content), model_id,
+                      embedding.tobytes()))
+                progress.advance()
+                # Commit as we go so an interrupted run only re-embeds what is left
+                if progress.done % progress_every == 0:
+                    cursor.connection.commit()
+        except BaseException:
+            # Don't make Titan calls for a run that has already failed; only the ones in flight finish
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def rebuild_lexical_index(cursor):
+    """Refills the FTS5 table the bot uses for keyword (BM25) search; a few ms for thousands of rows"""
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS threads_fts USING fts5(
+        id UNINDEXED,
+        header,
+        content,
+        tokenize = 'porter unicode61'
+    )
+    """)
+    cursor.execute("DELETE FROM threads_fts")
+    cursor.execute("INSERT INTO threads_fts (id, header, content) SELECT id, header, content FROM threads")
+
+
+def export_vectors(cursor):
+    """
+    Writes models/embeddings.npy and models/id_map.txt from the vectors stored in threads.db
+
+    Return:
+        Tuple[np.ndarray, List[str]]: normalized embeddings and their ids
+    """
+    id_map, vectors = [], []
+    # Grouped by source and category, so each partition the bot searches (see partitions.py) is one slice of rows
+    for thread_id, blob in cursor.execute(
+        "SELECT id, embedding FROM threads WHERE embedding IS NOT NULL ORDER BY source, category, rowid"
+    ):
+        id_map.append(thread_id)
+        vectors.append(np.frombuffer(blob, dtype=np.float32))
+
+    # Normalize and save embeddings
+    all_embeddings = np.array(vectors, dtype=np.float32)
+    if len(all_embeddings):
+        all_embeddings /= np.linalg.norm(all_embeddings, axis=1, keepdims=True)
+    # Written aside and renamed, so a reader never gets half a file
+    with open("models/embeddings.npy.tmp", "wb") as f:
+        np.save(f, all_embeddings)
+    os.replace("models/embeddings.npy.tmp", "models/embeddings.npy")
+
+    with open("models/id_map.txt.tmp", "w") as f:
+        f.write("\n".join(map(str, id_map)))
+    os.replace("models/id_map.txt.tmp", "models/id_map.txt")
+
+    return all_embeddings, id_map
+
+
+def write_snapshot_db(threads_db_path, path):
+    """Copies the thread text and meta of threads.db, without the embeddings, into a snapshot's own database"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS indexed", (threads_db_path,))
+        conn.execute("CREATE TABLE threads (id TEXT PRIMARY KEY, header TEXT, content TEXT, category TEXT, source TEXT)")
+        conn.execute("INSERT INTO threads SELECT id, header, content, category, source FROM indexed.threads ORDER BY rowid")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT INTO meta SELECT key, value FROM indexed.meta")
+        conn.commit()
+        conn.execute("DETACH DATABASE indexed")
+        rebuild_lexical_index(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def publish_snapshot(version, all_embeddings, id_map, root=config.snapshot_dir):
+    """
+    Writes a new index snapshot for the bot and makes it the current one
+
+    Everything is written to <version>.tmp first and renamed into place, and
+    only then does CURRENT move, so a running bot either keeps the old
+    snapshot or swaps to the new one whole (see snapshots.py).
+    """
+    final_dir = os.path.join(root, version)
+    if current_version(root) == version and os.path.isdir(final_dir):
+        print(f"Index unchanged; snapshot {version} is still current")
+        return
+    tmp_dir = f"{final_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # Compact store the bot memory-maps
+    write_store(os.path.join(tmp_dir, "store"), all_embeddings, id_map, config.embedding_store_dtype,
+                coarse=config.embedding_store_coarse, coarse_dims=config.embedding_store_coarse_dims)
+    # The FAISS index the bot opens when INDEX_BACKEND=faiss
+    if config.index_backend == "faiss":
+        save_faiss_index(build_faiss_index(all_embeddings, config.faiss_index_type), os.path.join(tmp_dir, "faiss.index"))
+        print(f"Built {config.faiss_index_type} FAISS index")
+    write_snapshot_db(config.threads_db_path, os.path.join(tmp_dir, "threads.db"))
+
+    shutil.rmtree(final_dir, ignore_errors=True)  # left by a run that stopped before publishing it
+    os.rename(tmp_dir, final_dir)
+    publish(root, version)
+    print(f"Published {config.embedding_store_dtype} snapshot {version} to {root}")
+    for old_version in prune(root, config.snapshot_keep):
+        print(f"Deleted old snapshot {old_version}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed the Discord export and course scripts into the bot's index")
+    parser.add_argument("--concurrency", type=int, default=embed_concurrency, help="Titan requests in flight at once")
+    parser.add_argument("--full", action="store_true", help="Re-embed every item, not just new or changed ones")
+    parser.add_argument("--dimensions", type=int, choices=TITAN_DIMENSIONS, default=embedding_dimensions,
+                        help="Titan embedding size; changing it re-embeds everything")
+    parser.add_argument("--qa-threads", default=config.qa_threads_path,
+                        help="Q&A threads from discordQASummerizer.py (.json or .jsonl)")
+    parser.add_argument("--transcripts", help="Also chunk and index the .txt course transcripts in this directory")
+    parser.add_argument("--chunk-config", help="script_to_json settings per transcript (JSON)")
+    args = parser.parse_args()
+
+    os.makedirs("models", exist_ok=True)
+    os.makedirs("data", exist_ok=True)
+
+    sources = itertools.chain(read_qa_threads(args.qa_threads), read_items(file_paths))
+    if args.transcripts:
+        sources = itertools.chain(sources, read_transcripts(args.transcripts, args.chunk_config))
+    items_by_id = {}
+    duplicates = 0
+    for item in sources:
+        duplicates += item[0] in items_by_id
+        items_by_id[item[0]] = item  # a file repeating an id: the later item wins
+    if duplicates:
+        print(f"Warning: {duplicates} items repeat an id from earlier in the same file and were dropped")
+    items = list(items_by_id.values())
+
+    conn = open_threads_db(config.threads_db_path)
+    cursor = conn.cursor()
+    try:
+        migrated = migrate_ids(cursor, items)
+        if migrated:
+            print(f"Moved {migrated} rows to namespaced ids")
+        to_embed, unchanged, deleted = plan_changes(items, cursor, embedding_model_name(args.dimensions), full=args.full)
+        print(f"{len(to_embed)} new or changed, {len(unchanged)} unchanged, {len(deleted)} removed")
+
+        cursor.executemany("DELETE FROM threads WHERE id = ?", [(thread_id,) for thread_id in deleted])
+        # Headers and categories can change without the content changing
+        cursor.executemany(
+            "UPDATE threads SET header = ?, category = ?, source = ? "
+            "WHERE id = ? AND (header IS NOT ? OR category IS NOT ? OR source IS NOT ?)",
+            [(header, category, source, thread_id, header, category, source)
+             for thread_id, header, content, category, source in unchanged],
+        )
+        relabelled = cursor.rowcount
+        embed_items(to_embed, cursor, concurrency=args.concurrency, dimensions=args.dimensions)
+
+        # Names the published snapshot; the bot also drops cached answers when it changes
+        cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        has_lexical_index = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'threads_fts'"
+        ).fetchone() is not None
+        has_version = cursor.execute("SELECT 1 FROM meta WHERE key = 'index_version'").fetchone() is not None
+        if to_embed or deleted or migrated or relabelled > 0 or not has_lexical_index or not has_version:
+            rebuild_lexical_index(cursor)
+            cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_version', ?)",
+                           (time.strftime("%Y%m%dT%H%M%S") + f"-{len(to_embed)}-{len(deleted)}",))
+        conn.commit()
+
+        all_embeddings, id_map = export_vectors(cursor)
+        version = cursor.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()[0]
+    finally:
+        conn.close()
 
+    # Running bots pick this up within SNAPSHOT_POLL_INTERVAL, no restart needed
+    publish_snapshot(version, all_embeddings, id_map)
 
-# Normalize and save embeddings
-all_embeddings = normalize(np.array(all_embeddings))
-np.save("models/embeddings.npy", all_embeddings)
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        print(f"Embedding cache: {embedding_cache.stats()}")
+    print(f"Done. Saved {len(id_map)} threads.")
 
-with open("models/id_map.txt", "w") as f:
-    f.write("\n".join(map(str, id_map)))
 
-print(f"Done. Saved {len(id_map)} threads.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class Metrics(object):
+    """
+    Rolling latency and size histograms for the answer pipeline.
+
+    Every timed stage and every measured value (token counts) keeps its last
+    `window` samples, so percentiles describe recent traffic rather than the
+    whole uptime. Counters only ever go up. Safe to use from executor threads.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.started_at = time.time()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._units = {}
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, unit="count"):
+        with self._lock:
+            self._samples[name].append(value)
+            self._units[name] = unit
+
+    @contextmanager
+    def span(self, stage):
+        """Times the block and records it under `stage` in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, unit="seconds")
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def drain(self):
+        """
+        Takes every sample and counter recorded since the last drain
+
+        Worker processes send this to the bot process, which merges it into
+        its own Metrics so /stats covers the whole deployment.
+        """
+        with self._lock:
+            samples = {name: (self._units[name], list(values)) for name, values in self._samples.items() if values}
+            counters = dict(self._counters)
+            self._samples.clear()
+            self._counters.clear()
+        return {"samples": samples, "counters": counters}
+
+    def merge(self, drained):
+        with self._lock:
+            for name, (unit, values) in drained["samples"].items():
+                self._samples[name].extend(values)
+                self._units[name] = unit
+            for name, amount in drained["counters"].items():
+                self._counters[name] += amount
+
+    def summary(self):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+            units = dict(self._units)
+            counters = dict(self._counters)
+
+        histograms = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, PERCENTILES)
+            histograms[name] = {
+                "unit": units[name],
+                "count": len(values),
+                "mean": float(np.mean(values)),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+            }
+        return {"uptime_seconds": time.time() - self.started_at, "histograms": histograms, "counters": counters}
+
+    def format_summary(self, stage_order=()):
+        """Plain-text table for the /stats command"""
+        summary = self.summary()
+        histograms = summary["histograms"]
+        names = [name for name in stage_order if name in histograms]
+        names += sorted(name for name in histograms if name not in names)
+
+        lines = [f"Uptime {summary['uptime_seconds'] / 3600:.1f}h, last {self.window} samples per row", ""]
+        lines.append(f"{'stage':<18}{'p50':>10}{'p95':>10}{'p99':>10}{'n':>6}")
+        for name in names:
+            row = histograms[name]
+            scale, suffix = (1000.0, "ms") if row["unit"] == "seconds" else (1.0, "")
+            values = "".join(f"{row[p] * scale:>8.1f}{suffix:<2}" for p in ("p50", "p95", "p99"))
+            lines.append(f"{name:<18}{values}{row['count']:>6}")
+
+        if summary["counters"]:
+            lines.append("")
+            lines.append(", ".join(f"{name}={value}" for name, value in sorted(summary["counters"].items())))
+        return "\n".join(lines)
+
+    def export(self, path, extra=None):
+        """Writes the summary as JSON, replacing the file atomically so readers never see half of it"""
+        summary = self.summary()
+        if extra:
+            summary.update(extra)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_path, path)
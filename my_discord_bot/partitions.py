@@ -0,0 +1,252 @@
+import re
+import numpy as np
+from thread_store import STOPWORDS
+
+# Words that send a question to a category's partitions. Keys are the
+# categories discordQASummerizer.py assigns; course chunks use their file's
+# category from chunk_config.json, which is matched by its own name. Entries
+# of five letters or more match as prefixes ("sourc" matches "sourcing"),
+# shorter ones as whole words, and entries with a space as phrases.
+CATEGORY_KEYWORDS = {
+    "Product Research": {"winning", "niche", "research", "trending", "saturat", "minea", "adspy", "find a product",
+                         "test a product", "testing products", "products should"},
+    "Website Customization": {"theme", "website", "homepage", "button", "banner", "logo", "font", "layout", "section",
+                              "css", "customiz", "store design", "product page", "buy it now"},
+    "Sourcing & Suppliers": {"supplier", "sourc", "aliexpress", "cj", "zendrop", "shipping", "warehouse", "sample",
+                             "agent", "fulfil", "dropshipping agent"},
+    "Shopify Setup / Apps": {"shopify", "app", "apps", "plugin", "domain", "payment", "paypal", "stripe", "checkout",
+                             "autods", "dsers", "refund"},
+    "Organic Advertising": {"tiktok", "organic", "reels", "instagram", "views", "viral", "hashtag", "bio", "ugc",
+                            "followers", "video"},
+    "Paid Advertising": {"ads", "ad", "facebook", "meta", "campaign", "budget", "cpc", "ctr", "roas", "pixel",
+                         "targeting", "adset", "target"},
+    "Mindset / Motivation": {"motivat", "mindset", "give up", "quit", "discipline", "burnout", "consisten",
+                             "mental", "overwhelm"},
+    "General Beginner Questions": {"beginner", "start", "starting", "first", "capital", "legit", "llc", "tax",
+                                   "how much money"},
+    "Pricing": {"price", "pricing", "margin", "profit", "markup"},
+    "Content Creation": {"content", "capcut", "editing", "script"},
+    "Video Production": {"camera", "filming", "lighting", "video"},
+}
+
+# How many more hits a backend without range search (faiss) fetches to filter down to the partitions
+FILTER_OVERFETCH = 5
+# Past this many row ranges (an index written before load_data.py grouped its rows)
+# one masked scan of everything beats a search per range
+MAX_RANGES = 64
+
+# Rows a partition needs before its scores get half the shift toward the pooled
+# mean; the mean of a handful of rows says more about those rows than about the
+# category, and shifting a one-row partition fully would pin its only row to the mean
+SHIFT_PRIOR_ROWS = 50
+
+# Too generic to say what a category is about when it is matched by name
+NAME_STOPWORDS = STOPWORDS | {"general", "questions", "question", "unknown", "other"}
+
+
+def category_terms(category):
+    """Keywords of a category: its CATEGORY_KEYWORDS entry plus the words of its name"""
+    name_terms = {word for word in re.findall(r"\w+", (category or "").lower())
+                  if len(word) > 2 and word not in NAME_STOPWORDS}
+    return set(CATEGORY_KEYWORDS.get(category, ())) | name_terms
+
+
+def matches(keyword, text, tokens):
+    if " " in keyword:
+        return keyword in text
+    if len(keyword) >= 5:
+        return any(token.startswith(keyword) for token in tokens)
+    return keyword in tokens
+
+
+def classify(question, categories):
+    """
+    The categories a question is about, by keyword
+
+    Args:
+        question (str): the user's question
+        categories (Iterable[str]): categories present in the index
+
+    Return:
+        Set[str]: matching categories; empty when no keyword matched, meaning search everything
+    """
+    text = question.lower()
+    tokens = set(re.findall(r"\w+", text))
+    return {category for category in categories
+            if any(matches(keyword, text, tokens) for keyword in category_terms(category))}
+
+
+def in_partitions(partitions, row):
+    return any(start <= row < stop for partition in partitions for start, stop in partition.ranges)
+
+
+class Partition(object):
+    """Rows of the vector index with one (source, category), as (start, stop) ranges"""
+
+    __slots__ = ("source", "category", "ranges", "size", "mean_vector")
+
+    def __init__(self, source, category, ranges):
+        self.source = source
+        self.category = category
+        self.ranges = ranges
+        self.size = sum(stop - start for start, stop in ranges)
+        self.mean_vector = None
+
+
+def build_partitions(id_map, metadata, vector_index):
+    """
+    Groups the index rows by (source, category)
+
+    load_data.py writes rows sorted by source and category, so each partition
+    is one contiguous range; an older index still works, just in more ranges.
+
+    Args:
+        id_map (Sequence[str]): thread id per vector row
+        metadata (Dict[str, Tuple[str, str]]): thread id -> (source, category), from ThreadStore.metadata
+        vector_index: index to compute each partition's mean vector from
+
+    Return:
+        List[Partition]
+    """
+    ranges = {}
+    for row, thread_id in enumerate(id_map):
+        key = metadata.get(thread_id, (None, None))
+        runs = ranges.setdefault(key, [])
+        if runs and runs[-1][1] == row:
+            runs[-1][1] = row + 1
+        else:
+            runs.append([row, row + 1])
+
+    partitions = []
+    for (source, category), runs in sorted(ranges.items(), key=lambda item: item[1][0][0]):
+        partition = Partition(source, category, [(start, stop) for start, stop in runs])
+        # Mean of the partition's vectors: the query's mean score over the partition is one dot product
+        total = None
+        for start, stop in partition.ranges:
+            for block_start in range(start, stop, 4096):
+                block = vector_index.vectors(np.arange(block_start, min(stop, block_start + 4096))).sum(axis=0)
+                total = block if total is None else total + block
+        partition.mean_vector = total / partition.size
+        partitions.append(partition)
+    return partitions
+
+
+def select_partitions(partitions, question, sources=None, mode="classify"):
+    """
+    Partitions to search for a question
+
+    Args:
+        sources (Iterable[str]): only these sources (e.g. {"course"}); None for all
+        mode (str): "classify" narrows to the categories the question is about,
+            "all" searches every partition (of the sources)
+
+    Return:
+        Tuple[List[Partition], Set[str]]: (partitions, categories the classifier picked)
+    """
+    candidates = [partition for partition in partitions if sources is None or partition.source in sources]
+    if mode != "classify":
+        return candidates, set()
+    picked = classify(question, {partition.category for partition in candidates})
+    if not picked:
+        return candidates, picked
+    # Partitions the classifier knows nothing about (a course file with no category) are always searched
+    return [partition for partition in candidates
+            if partition.category in picked or not category_terms(partition.category)], picked
+
+
+def partition_shifts(partitions, query):
+    """
+    What search_partitions adds to each partition's scores: how far its mean
+    score is below the mean over all the partitions' rows, scaled by
+    size / (size + SHIFT_PRIOR_ROWS) so small partitions barely move (0 for a single partition)
+    """
+    if len(partitions) < 2:
+        return [0.0] * len(partitions)
+    means = [float(partition.mean_vector @ query) for partition in partitions]
+    rows = sum(partition.size for partition in partitions)
+    pooled_mean = sum(mean * partition.size for mean, partition in zip(means, partitions)) / max(1, rows)
+    return [(pooled_mean - mean) * partition.size / (partition.size + SHIFT_PRIOR_ROWS)
+            for mean, partition in zip(means, partitions)]
+
+
+def shifted_scores(vector_index, partitions, query_emb, indices):
+    """Scores of the given rows on the same shifted scale search_partitions returns"""
+    query = np.asarray(query_emb, dtype=np.float32).ravel()
+    indices = np.asarray(indices)
+    scores = vector_index.vectors(indices) @ query
+    for partition, shift in zip(partitions, partition_shifts(partitions, query)):
+        for start, stop in partition.ranges:
+            scores[(indices >= start) & (indices < stop)] += shift
+    return scores
+
+
+def search_partitions(vector_index, partitions, query_emb, top_k):
+    """
+    Searches only the given partitions and merges their hits
+
+    Each partition's scores are shifted by how far its mean score is from the
+    mean over all searched rows, so a partition that is close to every
+    question (long course transcripts) does not crowd out one whose best rows
+    stand out more. The shift shrinks with the partition's size (see
+    SHIFT_PRIOR_ROWS), so a few-row partition keeps its raw scores; the result stays on the cosine scale the relevance
+    filters expect.
+
+    An index whose partitions are in more than MAX_RANGES pieces is scored
+    whole and masked. A backend that can do neither (faiss) searches
+    everything for FILTER_OVERFETCH times as many hits and keeps those in the
+    partitions, so a small partition can come back with fewer than top_k.
+
+    Return:
+        Tuple[np.ndarray, np.ndarray, int]: (scores, indices) best first, and the number of rows scanned
+    """
+    query = np.asarray(query_emb, dtype=np.float32).ravel()
+    scanned = sum(partition.size for partition in partitions)
+    shifts = partition_shifts(partitions, query)
+
+    if not hasattr(vector_index, "partition") or sum(len(partition.ranges) for partition in partitions) > MAX_RANGES:
+        # Shift of each row, -inf outside the partitions
+        row_shift = np.full(len(vector_index), -np.inf, dtype=np.float32)
+        for partition, shift in zip(partitions, shifts):
+            for start, stop in partition.ranges:
+                row_shift[start:stop] = shift
+        if hasattr(vector_index, "score"):
+            scores = vector_index.score(query) + row_shift
+            indices = np.arange(len(scores))
+        else:
+            scores, indices = vector_index.search(query, top_k * FILTER_OVERFETCH)
+            scores = scores + row_shift[indices]
+        keep = np.isfinite(scores)
+        scores, indices = scores[keep], indices[keep]
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return scores[order], indices[order], len(vector_index)
+
+    all_scores, all_indices = [], []
+    for partition, shift in zip(partitions, shifts):
+        for start, stop in partition.ranges:
+            scores, indices = vector_index.partition(start, stop).search(query, top_k)
+            all_scores.append(scores + shift)
+            all_indices.append(indices + start)
+    if not all_scores:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), 0
+
+    scores, indices = np.concatenate(all_scores), np.concatenate(all_indices)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return scores[order], indices[order], scanned
+
+
+def search_selected(vector_index, partitions, selected, query_emb, top_k, sources=None, min_score=0.5, min_hits=3):
+    """
+    search_partitions over the partitions select_partitions picked, widened to
+    every partition of the sources when fewer than `min_hits` hits score
+    `min_score`: a keyword guess that found little is not trusted to hide the rest
+
+    Return:
+        Tuple[np.ndarray, np.ndarray, int, List[Partition], bool]:
+        (scores, indices, rows scanned, partitions searched, whether it widened)
+    """
+    scores, indices, scanned = search_partitions(vector_index, selected, query_emb, top_k)
+    candidates = [partition for partition in partitions if sources is None or partition.source in sources]
+    if len(selected) < len(candidates) and np.count_nonzero(scores >= min_score) < min_hits:
+        scores, indices, more = search_partitions(vector_index, candidates, query_emb, top_k)
+        return scores, indices, scanned + more, candidates, True
+    return scores, indices, scanned, selected, False
@@ -0,0 +1,364 @@
+import threading
+import numpy as np
+from TitanEmbeddings import generate_titan_vector_embedding, get_aws_client, TITAN_DIMENSIONS
+from answer_cache import AnswerCache
+from metrics import Metrics
+from retrieval import select_threads, cap_categories, fuse
+from prompts import build_rag_prompt, STATIC_PROMPT_TOKENS
+from sessions import estimate_tokens
+from context_packer import pack_threads
+from consistency import check_index, report_index_problems
+from snapshots import SnapshotManager
+from partitions import select_partitions, search_partitions, search_selected, shifted_scores, in_partitions
+import config
+
+# Everything in this module blocks (Bedrock HTTP calls, SQLite, NumPy), so the
+# bot runs it on worker threads instead of the Discord event loop.
+
+# --- AWS Claude Setup ---
+model_id = "anthropic.claude-3-haiku-20240307-v1:0"
+
+model_kwargs = {
+    "max_tokens": 2048,
+    "temperature": 0.0,
+    "top_k": 250,
+    "top_p": 0.9,
+    "stop_sequences": ["\n\nHuman"],
+}
+
+# langchain_aws alone takes most of a second to import, so the Claude client
+# is built on first use (or by warm_up) rather than before the bot can connect
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            from langchain_aws import ChatBedrock
+            _llm = ChatBedrock(client=get_aws_client(), model_id=model_id, model_kwargs=model_kwargs)
+    return _llm
+
+
+# Load the published index snapshot (memory-mapped, so this reads almost nothing
+# yet); reload_index swaps in newer ones without a restart
+index_snapshots = SnapshotManager(
+    config,
+    config.snapshot_dir,
+    check=lambda snapshot: check_consistency(snapshot, strict=True),
+    warm=lambda snapshot: warm_snapshot(snapshot),
+)
+
+metrics = Metrics(window=config.metrics_window)
+
+# Order of the rows in /stats
+STAGES = ("queue_wait", "lexical", "embed", "search", "scan_rows", "cutoff", "fetch", "pack", "prompt_build",
+          "first_token", "generation", "send", "total", "context_tokens", "prompt_tokens", "completion_tokens",
+          "startup_import", "startup_connect", "warmup")
+
+answer_cache = None
+if config.answer_cache_enabled:
+    answer_cache = AnswerCache(
+        threshold=config.answer_cache_threshold,
+        ttl_seconds=config.answer_cache_ttl,
+        max_entries=config.answer_cache_max_entries,
+    )
+
+
+def context_budget(user_question, formatted_conversation=""):
+    """
+    Tokens the retrieved threads may use: CONTEXT_TOKEN_BUDGET, cut down to
+    what PROMPT_TOKEN_BUDGET leaves after the rest of the prompt
+
+    Return:
+        int: budget for pack_threads; 0 for no limit
+    """
+    budget = config.context_token_budget
+    if config.prompt_token_budget:
+        room = (config.prompt_token_budget - STATIC_PROMPT_TOKENS
+                - estimate_tokens(formatted_conversation) - estimate_tokens(user_question))
+        # At least 1, since 0 would mean no limit: with no room left no thread fits
+        budget = max(1, min(budget, room) if budget else room)
+    return budget
+
+
+def retrieve_context(user_question, sources=None, formatted_conversation=""):
+    """
+    Embeds the question, finds the closest threads and loads their text.
+
+    Everything comes from one index snapshot, even if a newer one is
+    swapped in halfway.
+
+    Args:
+        user_question (str): the question
+        sources (Iterable[str]): only answer from threads of these sources (e.g. {"course"}); None for all
+        formatted_conversation (str): history going into the same prompt, which the threads make room for
+
+    Returns:
+        dict: the same keys the bot keeps for /show_context
+    """
+    with index_snapshots.acquire() as snapshot:
+        # Partitions (source, category) to search; None searches the whole index at once
+        partitions, picked = None, set()
+        if config.partition_mode != "off" or sources is not None:
+            mode = config.partition_mode if config.partition_mode != "off" else "all"
+            partitions, picked = select_partitions(snapshot.partitions(), user_question, sources, mode)
+            if picked:
+                metrics.count("questions_classified")
+
+        all_lexical_hits = []
+        if config.hybrid_mode != "off":
+            with metrics.span("lexical"):
+                positions = snapshot.id_positions()
+                all_lexical_hits = [
+                    (positions[thread_id], score)
+                    for thread_id, score in snapshot.thread_store.search_lexical(user_question, config.retrieval_top_k)
+                    if thread_id in positions
+                ]
+        lexical_hits = [(index, score) for index, score in all_lexical_hits
+                        if partitions is None or in_partitions(partitions, index)]
+
+        query_emb = None
+        if (config.hybrid_mode == "lexical_first" and lexical_hits
+                and lexical_hits[0][1] >= config.hybrid_lexical_min_score):
+            # A strong keyword match (an app name, a URL) is enough; skip the Titan call
+            metrics.count("lexical_only_answers")
+            top_bm25 = lexical_hits[0][1]
+            cosine_scores = np.array([score / top_bm25 for index, score in lexical_hits])
+            top_indices = np.array([index for index, score in lexical_hits], dtype=np.int64)
+        else:
+            with metrics.span("embed"):
+                # Same size as the index (an index from before sizes were configurable gets the default)
+                dimensions = snapshot.dimensions if snapshot.dimensions in TITAN_DIMENSIONS else None
+                query_emb = generate_titan_vector_embedding(user_question, dimensions).reshape(1, -1)
+                query_emb = query_emb / np.linalg.norm(query_emb)
+
+            with metrics.span("search"):
+                if partitions is None:
+                    cosine_scores, top_indices = snapshot.vector_index.search(query_emb[0], config.retrieval_top_k)
+                    scanned = len(snapshot.vector_index)
+                elif not picked:
+                    cosine_scores, top_indices, scanned = search_partitions(
+                        snapshot.vector_index, partitions, query_emb[0], config.retrieval_top_k
+                    )
+                else:
+                    cosine_scores, top_indices, scanned, partitions, widened = search_selected(
+                        snapshot.vector_index, snapshot.partitions(), partitions, query_emb[0],
+                        config.retrieval_top_k, sources, config.retrieval_min_score, config.partition_min_hits,
+                    )
+                    if widened:
+                        metrics.count("partition_fallbacks")
+                        lexical_hits = [(index, score) for index, score in all_lexical_hits
+                                        if in_partitions(partitions, index)]
+                if lexical_hits:
+                    if partitions is None:
+                        def cosine_of(indices):
+                            return snapshot.vector_index.vectors(indices) @ query_emb[0]
+                    else:
+                        # On the same per-partition shifted scale as the vector hits they are fused with
+                        def cosine_of(indices):
+                            return shifted_scores(snapshot.vector_index, partitions, query_emb[0], indices)
+                    cosine_scores, top_indices = fuse(
+                        (cosine_scores, top_indices),
+                        lexical_hits,
+                        cosine_of,
+                        method=config.hybrid_fusion,
+                        lexical_weight=config.hybrid_lexical_weight,
+                        rrf_k=config.hybrid_rrf_k,
+                    )
+                    cosine_scores = cosine_scores[:config.retrieval_top_k]
+                    top_indices = top_indices[:config.retrieval_top_k]
+            metrics.observe("scan_rows", scanned)
+
+        with metrics.span("cutoff"):
+            # MMR needs the query vector, which a keyword-only lookup never computed
+            strategy = config.retrieval_strategy
+            if strategy == "mmr" and query_emb is None:
+                strategy = "dropoff"
+            vectors = snapshot.vector_index.vectors(top_indices) if strategy == "mmr" else None
+            top_threads, z_scores, max_gap = select_threads(
+                strategy,
+                cosine_scores,
+                top_indices,
+                vectors=vectors,
+                query_emb=query_emb[0] if query_emb is not None else None,
+                min_score=config.retrieval_min_score,
+                max_threads=config.retrieval_max_threads,
+                diversity=config.mmr_diversity,
+            )
+            if config.retrieval_max_per_category:
+                categories = snapshot.thread_store.categories([snapshot.id_map[idx] for idx, cos_sim, z in top_threads])
+                top_threads = cap_categories(top_threads, categories, config.retrieval_max_per_category)
+
+        print(f"Using top {len(top_threads)} threads (dropoff at gap = {max_gap:.2f})")
+
+        with metrics.span("fetch"):
+            thread_ids = [snapshot.id_map[idx] for idx, cos_sim, z in top_threads]
+            filtered_threads = snapshot.thread_store.fetch(thread_ids)
+
+        with metrics.span("pack"):
+            formatted_history, context_tokens, trimmed = pack_threads(
+                filtered_threads, user_question, context_budget(user_question, formatted_conversation),
+                config.context_max_thread_tokens,
+            )
+        metrics.observe("context_tokens", context_tokens)
+        if trimmed:
+            metrics.count("threads_trimmed", trimmed)
+
+        return {
+            "question": user_question,
+            "top_threads": top_threads,
+            "z_scores": z_scores,
+            "cosine_scores": cosine_scores,
+            "gap": max_gap,
+            "formatted_history": formatted_history,
+            "query_embedding": query_emb[0] if query_emb is not None else None,
+            "thread_ids": thread_ids,
+            "index_version": snapshot.thread_store.index_version(),
+            "partitions": None if partitions is None else [
+                f"{partition.source}/{partition.category}" for partition in partitions
+            ],
+        }
+
+
+def cacheable(query_data, formatted_conversation):
+    # A follow-up ("explain that simpler") means something else in every conversation,
+    # so only questions asked without history are answered from or stored in the cache
+    return answer_cache is not None and query_data["query_embedding"] is not None and not formatted_conversation
+
+
+def cached_answer(query_data, formatted_conversation=""):
+    """Answer to an earlier, near-identical question over the same threads, or None"""
+    if not cacheable(query_data, formatted_conversation):
+        return None
+    return answer_cache.lookup(query_data["query_embedding"], query_data["thread_ids"], query_data["index_version"])
+
+
+def remember_answer(query_data, answer, formatted_conversation=""):
+    if cacheable(query_data, formatted_conversation):
+        answer_cache.store(query_data["query_embedding"], query_data["thread_ids"], answer, query_data["index_version"])
+
+
+# --- Calling Claude ---
+def record_usage(usage_metadata):
+    """Token counts LangChain reports for a Claude call, if it reported any"""
+    if usage_metadata:
+        metrics.observe("prompt_tokens", usage_metadata.get("input_tokens", 0))
+        metrics.observe("completion_tokens", usage_metadata.get("output_tokens", 0))
+
+
+def generate_answer(rag_prompt):
+    print("Calling Claude")
+    with metrics.span("generation"):
+        claude_response = get_llm().invoke(rag_prompt)
+    record_usage(getattr(claude_response, "usage_metadata", None))
+    return claude_response.content.strip()
+
+
+def stream_answer(rag_prompt):
+    """Yields Claude's answer in pieces as Bedrock streams it back"""
+    print("Calling Claude (streaming)")
+    usage = None
+    for chunk in get_llm().stream(rag_prompt):
+        # Usage arrives on the last, empty chunk
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        if chunk.content:
+            yield chunk.content
+    record_usage(usage)
+
+
+def answer_events(user_question, formatted_conversation, stream=True, sources=None):
+    """
+    Answers a question as a sequence of (kind, value) events for the bot to act on
+
+    Kinds, in order: "context" (the retrieve_context dict, for /show_context),
+    then either "cached" (a whole answer from the answer cache), "chunk"
+    (pieces of a streamed answer) or "answer" (a whole generated answer).
+    The same events come from a worker process in supervisor mode.
+    `sources` limits the threads answered from, as in retrieve_context.
+    """
+    query_data = retrieve_context(user_question, sources, formatted_conversation)
+    yield "context", query_data
+
+    answer = cached_answer(query_data, formatted_conversation)
+    if answer is not None:
+        print("Answer cache hit")
+        metrics.count("answer_cache_hits")
+        yield "cached", answer
+        return
+
+    with metrics.span("prompt_build"):
+        rag_prompt = build_rag_prompt(user_question, formatted_conversation, query_data["formatted_history"])
+    if stream:
+        parts = []
+        with metrics.span("generation"):
+            for chunk in stream_answer(rag_prompt):
+                parts.append(chunk)
+                yield "chunk", chunk
+        answer = "".join(parts).strip()
+    else:
+        answer = generate_answer(rag_prompt)
+        yield "answer", answer
+    remember_answer(query_data, answer, formatted_conversation)
+
+
+# --- Startup ---
+def check_consistency(snapshot=None, strict=False):
+    """
+    Runs the index/threads.db alignment check as configured by INDEX_CHECK
+
+    Args:
+        snapshot (IndexSnapshot): snapshot to check, the live one by default
+        strict (bool): raise on problems even in "warn" mode (a new snapshot is
+            better not swapped in than swapped in broken)
+    """
+    if config.index_check == "off":
+        return
+    if snapshot is None:
+        # Held until the check is done so a swap can't close its threads.db underneath it
+        with index_snapshots.acquire() as snapshot:
+            return check_consistency(snapshot, strict)
+    problems = check_index(snapshot.id_map, snapshot.vector_index, snapshot.thread_store)
+    report_index_problems(problems, "strict" if strict else config.index_check)
+
+
+def warm_snapshot(snapshot):
+    """Pages a snapshot's vectors and FTS index in from disk and builds its id lookup and partitions"""
+    snapshot.id_positions()
+    if config.partition_mode != "off":
+        snapshot.partitions()
+    if len(snapshot.vector_index):
+        snapshot.vector_index.search(np.ones(snapshot.vector_index.vectors([0]).shape[1], dtype=np.float32), 1)
+    snapshot.thread_store.search_lexical("shopify", 1)
+
+
+def warm_up():
+    """
+    Does the slow first-use work before the first question has to
+
+    Imports langchain_aws and creates the Bedrock clients, warms up the
+    index snapshot and starts watching for new ones. The bot runs this in
+    the background once it is connected; a question that arrives earlier
+    simply does whatever part of it is still missing.
+    """
+    with metrics.span("warmup"):
+        get_llm()
+        get_aws_client()
+        with index_snapshots.acquire() as snapshot:
+            warm_snapshot(snapshot)
+            check_consistency(snapshot)
+    if config.snapshot_poll_interval > 0:
+        start_index_watcher()
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def start_index_watcher():
+    """Swaps in snapshots load_data.py publishes, checking every SNAPSHOT_POLL_INTERVAL seconds"""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = index_snapshots.start_watcher(config.snapshot_poll_interval)
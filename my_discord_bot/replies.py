@@ -0,0 +1,71 @@
+import time
+
+# Discord rejects messages longer than this
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+def split_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Splits text into Discord-sized pieces, breaking at a paragraph, line or word where possible"""
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, limit // 2, limit)
+            if cut != -1:
+                break
+        if cut == -1:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+async def send_long(channel, text):
+    """Sends text as one message, or several if it is over Discord's limit"""
+    for part in split_message(text):
+        await channel.send(part)
+
+
+class StreamingReply(object):
+    """
+    Shows a streamed answer in Discord as it arrives.
+
+    The first message goes out with the first tokens, then it is edited at
+    most once every `edit_interval` seconds to stay inside Discord's edit rate
+    limit. Text past 2000 characters continues in follow-up messages.
+    """
+
+    def __init__(self, channel, edit_interval=1.0):
+        self.channel = channel
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.first_token_at = None
+        self._messages = []
+        self._shown = []
+        self._last_flush = 0.0
+
+    async def add(self, chunk):
+        self.text += chunk
+        if self.first_token_at is None and self.text.strip():
+            self.first_token_at = time.perf_counter()
+            await self.flush()
+        elif time.monotonic() - self._last_flush >= self.edit_interval:
+            await self.flush()
+
+    async def flush(self):
+        for position, part in enumerate(split_message(self.text.strip())):
+            if position < len(self._messages):
+                if self._shown[position] != part:
+                    await self._messages[position].edit(content=part)
+                    self._shown[position] = part
+            else:
+                self._messages.append(await self.channel.send(part))
+                self._shown.append(part)
+        self._last_flush = time.monotonic()
+
+    async def finish(self):
+        """Makes sure the final text is shown and returns it"""
+        await self.flush()
+        return self.text.strip()
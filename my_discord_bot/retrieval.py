@@ -0,0 +1,160 @@
+import numpy as np
+
+# Decides which of the top-k search hits go into the prompt. Every strategy
+# takes the hits best first and returns (top_threads, z_scores, gap), where
+# top_threads is a list of (index, score, z-score) as /show_context prints them
+# (score is the cosine similarity, or the fused score in hybrid search) and
+# gap is the z-score drop the cutoff was placed at.
+
+STRATEGIES = ("dropoff", "threshold", "mmr")
+FUSIONS = ("rrf", "weighted")
+
+
+def zscores(scores):
+    """z-scores of the scores (sample std); all zero when they are all equal"""
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) < 2:
+        return np.zeros(len(scores))
+    std_deviation = np.std(scores, ddof=1)
+    if std_deviation == 0:
+        return np.zeros(len(scores))
+    return (scores - np.mean(scores)) / std_deviation
+
+
+def dropoff_cutoff(sorted_z):
+    """
+    Finds the largest drop between neighbouring z-scores
+
+    Args:
+        sorted_z (np.ndarray): z-scores, highest first
+
+    Return:
+        Tuple[int, float]: (how many to keep, size of the drop); (0, 0.0) when nothing drops
+    """
+    if len(sorted_z) < 2:
+        return 0, 0.0
+    gaps = sorted_z[:-1] - sorted_z[1:]
+    best = int(np.argmax(gaps))  # first of equal gaps, like the loop it replaced
+    if gaps[best] <= 0:
+        return 0, 0.0
+    return best + 1, float(gaps[best])
+
+
+def _threads(indices, scores, z, keep):
+    return [(indices[i], scores[i], z[i]) for i in keep]
+
+
+def select_dropoff(scores, indices):
+    """Keeps everything above the largest z-score drop"""
+    z = zscores(scores)
+    count, gap = dropoff_cutoff(z)
+    return _threads(indices, scores, z, range(count)), z, gap
+
+
+def select_threshold(scores, indices, min_score=0.5, max_threads=5):
+    """Keeps up to max_threads hits with cosine similarity of at least min_score"""
+    z = zscores(scores)
+    count = min(int(np.count_nonzero(np.asarray(scores) >= min_score)), max_threads)
+    return _threads(indices, scores, z, range(count)), z, 0.0
+
+
+def select_mmr(scores, indices, vectors, query_emb, max_threads=5, diversity=0.3):
+    """
+    Maximal marginal relevance over the hits above the dropoff cutoff
+
+    Each pick maximises (1 - diversity) * relevance - diversity * similarity
+    to the threads already picked, so near-duplicate threads do not crowd out
+    a second angle on the question.
+    """
+    z = zscores(scores)
+    count, gap = dropoff_cutoff(z)
+    count = max(count, min(max_threads, len(scores)))  # give MMR something to choose from
+    candidates = np.asarray(vectors[:count], dtype=np.float32)
+    relevance = candidates @ np.asarray(query_emb, dtype=np.float32).ravel()
+    similarity = candidates @ candidates.T
+
+    picked = []
+    redundancy = np.full(count, -np.inf)
+    available = np.ones(count, dtype=bool)
+    for _ in range(min(max_threads, count)):
+        penalty = np.where(np.isinf(redundancy), 0.0, redundancy)
+        gain = np.where(available, (1 - diversity) * relevance - diversity * penalty, -np.inf)
+        choice = int(np.argmax(gain))
+        picked.append(choice)
+        available[choice] = False
+        redundancy = np.maximum(redundancy, similarity[choice])
+    return _threads(indices, scores, z, picked), z, gap
+
+
+def cap_categories(top_threads, categories, max_per_category):
+    """
+    Drops threads past max_per_category from any one category, keeping rank order
+
+    Args:
+        categories (Sequence[str]): category per thread in top_threads
+    """
+    if not max_per_category:
+        return top_threads
+    seen = {}
+    kept = []
+    for thread, category in zip(top_threads, categories):
+        seen[category] = seen.get(category, 0) + 1
+        if seen[category] <= max_per_category:
+            kept.append(thread)
+    return kept
+
+
+def select_threads(strategy, scores, indices, vectors=None, query_emb=None, min_score=0.5, max_threads=5,
+                   diversity=0.3):
+    """Runs the named strategy; see STRATEGIES"""
+    if strategy == "dropoff":
+        return select_dropoff(scores, indices)
+    if strategy == "threshold":
+        return select_threshold(scores, indices, min_score=min_score, max_threads=max_threads)
+    if strategy == "mmr":
+        return select_mmr(scores, indices, vectors, query_emb, max_threads=max_threads, diversity=diversity)
+    raise ValueError(f"Unknown retrieval strategy {strategy!r}, expected one of {STRATEGIES}")
+
+
+def fuse(vector_hits, lexical_hits, cosine_of, method="rrf", lexical_weight=0.3, rrf_k=60):
+    """
+    Merges embedding and keyword hits into one ranking
+
+    Args:
+        vector_hits (Tuple[np.ndarray, np.ndarray]): (cosine scores, indices) best first
+        lexical_hits (List[Tuple[int, float]]): (index, BM25 score) best first
+        cosine_of (callable): cosine scores for an array of indices, for keyword-only hits
+        method (str): "rrf" (reciprocal rank fusion) or "weighted" (blend of cosine and scaled BM25)
+        lexical_weight (float): share of the BM25 score in "weighted"
+        rrf_k (int): rank offset in "rrf"; larger flattens the difference between ranks
+
+    Return:
+        Tuple[np.ndarray, np.ndarray]: (fused scores in 0..1, indices) best first
+    """
+    vector_scores, vector_indices = vector_hits
+    cosine = dict(zip(vector_indices.tolist(), vector_scores.tolist()))
+    missing = np.array([index for index, score in lexical_hits if index not in cosine], dtype=np.int64)
+    if len(missing):
+        cosine.update(zip(missing.tolist(), np.asarray(cosine_of(missing)).tolist()))
+
+    candidates = np.fromiter(cosine.keys(), dtype=np.int64, count=len(cosine))
+    cosines = np.fromiter(cosine.values(), dtype=np.float64, count=len(cosine))
+    bm25 = dict(lexical_hits)
+
+    if method == "weighted":
+        top_bm25 = max(bm25.values(), default=0.0)
+        lexical = np.array([bm25.get(index, 0.0) / top_bm25 if top_bm25 > 0 else 0.0 for index in candidates.tolist()])
+        fused = (1 - lexical_weight) * cosines + lexical_weight * lexical
+    elif method == "rrf":
+        vector_rank = np.empty(len(candidates))
+        vector_rank[np.argsort(-cosines, kind="stable")] = np.arange(1, len(candidates) + 1)
+        lexical_rank = {index: rank for rank, (index, score) in enumerate(lexical_hits, start=1)}
+        fused = 1.0 / (rrf_k + vector_rank)
+        fused += np.array([1.0 / (rrf_k + lexical_rank[index]) if index in lexical_rank else 0.0
+                           for index in candidates.tolist()])
+        fused *= (rrf_k + 1) / 2.0  # first in both lists scores 1.0
+    else:
+        raise ValueError(f"Unknown fusion {method!r}, expected one of {FUSIONS}")
+
+    order = np.argsort(-fused, kind="stable")
+    return fused[order], candidates[order]
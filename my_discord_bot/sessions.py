@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+def estimate_tokens(text):
+    """Rough Claude token count: about four characters per token for English"""
+    return len(text) // 4 + 1
+
+
+class Session(object):
+    __slots__ = ("key", "turns", "last_query_data", "last_active")
+
+    def __init__(self, key, max_turns):
+        self.key = key
+        self.turns = deque(maxlen=max_turns)  # (question, answer), oldest first
+        self.last_query_data = None  # what /show_context prints for this user
+        self.last_active = time.time()
+
+
+class SessionStore(object):
+    """
+    Conversation memory per (channel, user).
+
+    Each session keeps its last `max_turns` exchanges in a ring buffer, and
+    only as many of them as fit `history_tokens` go into the prompt. Sessions
+    idle for `idle_seconds` are dropped from memory, and at most
+    `max_sessions` are held at once. With a `db_path`, turns are also written
+    to SQLite and reloaded the first time a user speaks after a restart.
+    """
+
+    def __init__(self, max_turns=5, history_tokens=1500, idle_seconds=3600, max_sessions=10000, db_path=None):
+        self.max_turns = max_turns
+        self.history_tokens = history_tokens
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # least recently active first
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(db_path, timeout=10.0, check_same_thread=False)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS turns (
+                channel_id INTEGER,
+                user_id INTEGER,
+                created_at REAL,
+                question TEXT,
+                answer TEXT
+            )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (channel_id, user_id, created_at)")
+            self._conn.commit()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, channel_id, user_id):
+        key = (channel_id, user_id)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = Session(key, self.max_turns)
+                if self._conn is not None:
+                    rows = self._conn.execute(
+                        "SELECT question, answer FROM turns WHERE channel_id = ? AND user_id = ? "
+                        "ORDER BY created_at DESC LIMIT ?", (channel_id, user_id, self.max_turns)
+                    ).fetchall()
+                    session.turns.extend(reversed(rows))
+                self._sessions[key] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(key)
+            session.last_active = time.time()
+            return session
+
+    def add_turn(self, session, question, answer):
+        with self._lock:
+            session.turns.append((question, answer))
+            session.last_active = time.time()
+            if self._conn is not None:
+                channel_id, user_id = session.key
+                self._conn.execute(
+                    "INSERT INTO turns (channel_id, user_id, created_at, question, answer) VALUES (?, ?, ?, ?, ?)",
+                    (channel_id, user_id, time.time(), question, answer),
+                )
+                # Keep the table as bounded as the ring buffer
+                self._conn.execute(
+                    "DELETE FROM turns WHERE channel_id = ? AND user_id = ? AND rowid NOT IN ("
+                    "SELECT rowid FROM turns WHERE channel_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT ?)",
+                    (channel_id, user_id, channel_id, user_id, self.max_turns),
+                )
+                self._conn.commit()
+
+    def format_history(self, session):
+        """Newest turns that fit the token budget, oldest first, in the prompt's User/Assistant format"""
+        with self._lock:
+            # add_turn may be appending to the ring buffer from another thread
+            turns = list(session.turns)
+        lines, used = [], 0
+        for question, answer in reversed(turns):
+            line = f"User: {question}\nAssistant: {answer}\n"
+            used += estimate_tokens(line)
+            if used > self.history_tokens:
+                break
+            lines.append(line)
+        return "".join(reversed(lines))
+
+    def evict_idle(self):
+        """Drops sessions nobody has used for idle_seconds; persisted turns stay on disk"""
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            idle = []
+            for key, session in self._sessions.items():  # least recently active first
+                if session.last_active >= cutoff:
+                    break
+                idle.append(key)
+            for key in idle:
+                del self._sessions[key]
+        return len(idle)
@@ -0,0 +1,252 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from embedding_store import open_store, store_exists
+from partitions import build_partitions
+from thread_store import ThreadStore
+from vector_index import load_index
+
+# load_data.py publishes every re-index as a directory of its own under the
+# snapshot root and then points CURRENT at it:
+#   CURRENT                  name of the live snapshot, replaced atomically
+#   <version>/store/         embedding store (see embedding_store.py)
+#   <version>/faiss.index    FAISS index, when INDEX_BACKEND=faiss
+#   <version>/threads.db     thread text, categories and the FTS table
+# A snapshot directory is never written again once CURRENT names it, so a bot
+# can map its files at any time and never see half of a re-index.
+
+CURRENT_FILE = "CURRENT"
+
+
+def current_version(root):
+    """Name of the snapshot CURRENT points at, or None before the first publish"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish(root, version):
+    """Points CURRENT at a snapshot that is completely written"""
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def prune(root, keep):
+    """
+    Deletes all but the `keep` newest snapshots, never the current one
+
+    A bot still answering from a deleted snapshot is unaffected: its mapped
+    files and open connections keep the data until it lets go of them.
+
+    Return:
+        List[str]: versions deleted
+    """
+    current = current_version(root)
+    versions = sorted(name for name in os.listdir(root)
+                      if os.path.isdir(os.path.join(root, name)) and not name.endswith(".tmp"))
+    deleted = []
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version == current:
+            continue
+        try:
+            shutil.rmtree(os.path.join(root, version))
+            deleted.append(version)
+        except OSError as e:  # Windows will not delete files that are still open
+            print(f"Could not delete snapshot {version}: {e}")
+    return deleted
+
+
+class IndexSnapshot(object):
+    """
+    Vector index, id map and thread store of one version of the corpus.
+
+    Retrieval holds a snapshot for the whole of one question (see
+    SnapshotManager.acquire), so a swap never mixes rows of two versions.
+    """
+
+    def __init__(self, version, vector_index, id_map, thread_store, store=None):
+        self.version = version
+        self.vector_index = vector_index
+        self.id_map = id_map
+        self.thread_store = thread_store
+        self.store = store
+        if store is not None:
+            self.dimensions = store.manifest["dimensions"]
+        else:
+            self.dimensions = vector_index.vectors([0]).shape[1] if len(vector_index) else None
+        self._id_positions = None
+        self._partitions = None
+        self._users = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, config, root=None, version=None):
+        """
+        Opens a published snapshot, or the files at the config paths when version is None
+
+        The store is memory-mapped, so this reads almost nothing yet.
+        """
+        if version is not None:
+            directory = os.path.join(root, version)
+            store_dir = os.path.join(directory, "store")
+            faiss_path = os.path.join(directory, "faiss.index")
+            threads_db_path = os.path.join(directory, "threads.db")
+        else:
+            store_dir = config.embedding_store_dir
+            faiss_path = config.faiss_index_path
+            threads_db_path = config.threads_db_path
+
+        store = open_store(store_dir) if store_exists(store_dir) else None
+        vector_index = load_index(
+            config.index_backend,
+            embeddings_path=config.embeddings_path,  # only without a store
+            faiss_path=faiss_path,
+            nprobe=config.faiss_nprobe,
+            ef_search=config.faiss_ef_search,
+            store=store,
+            candidates=config.two_stage_candidates,
+        )
+        if store is not None:
+            id_map = store.ids
+        else:
+            with open(config.id_map_path) as f:
+                id_map = f.read().splitlines()
+
+        thread_store = ThreadStore(
+            threads_db_path,
+            pool_size=config.thread_store_pool_size,
+            in_memory=config.thread_store_in_memory,
+        )
+        return cls(version, vector_index, id_map, thread_store, store=store)
+
+    def id_positions(self):
+        """Thread id -> row in the vector index, built on first use"""
+        if self._id_positions is None:
+            self._id_positions = {thread_id: position for position, thread_id in enumerate(self.id_map)}
+        return self._id_positions
+
+    def partitions(self):
+        """
+        Rows of each (source, category), built on first use
+
+        Return:
+            List[Partition]
+        """
+        if self._partitions is None:
+            self._partitions = build_partitions(self.id_map, self.thread_store.metadata(), self.vector_index)
+        return self._partitions
+
+    def enter(self):
+        with self._lock:
+            self._users += 1
+
+    def leave(self):
+        with self._lock:
+            self._users -= 1
+            drained = self._retired and self._users == 0
+        if drained:
+            self.close()
+
+    def retire(self):
+        """Closes the snapshot once the last question using it is done"""
+        with self._lock:
+            self._retired = True
+            drained = self._users == 0
+        if drained:
+            self.close()
+
+    def close(self):
+        self.thread_store.close()
+        # Dropping the arrays unmaps the store's files
+        self.vector_index = self.id_map = self.store = self._id_positions = self._partitions = None
+
+
+class SnapshotManager(object):
+    """
+    The snapshot questions are answered from, swapped for a newer one without a restart.
+
+    reload() opens the version CURRENT names, checks and warms it up while
+    questions keep using the old one, then swaps it in. Questions that had
+    already started finish on the old snapshot, which is closed (and its
+    memory freed) when the last of them is done.
+    """
+
+    def __init__(self, config, root, check=None, warm=None):
+        """
+        Args:
+            config: the config module
+            root (str): snapshot directory load_data.py publishes to
+            check (callable): called with a new snapshot before it goes live; raising keeps the old one
+            warm (callable): called with a new snapshot to page it in before it goes live
+        """
+        self.config = config
+        self.root = root
+        self.check = check
+        self.warm = warm
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._failed_version = None  # not retried until CURRENT changes again
+        self.current = IndexSnapshot.open(config, root, current_version(root))
+
+    @contextmanager
+    def acquire(self):
+        with self._swap_lock:
+            snapshot = self.current
+            snapshot.enter()
+        try:
+            yield snapshot
+        finally:
+            snapshot.leave()
+
+    def reload(self):
+        """
+        Swaps in the published snapshot if it is not the one in use
+
+        Return:
+            bool: True if a new snapshot went live
+        """
+        with self._reload_lock:
+            version = current_version(self.root)
+            if version is None or version in (self.current.version, self._failed_version):
+                return False
+            snapshot = None
+            try:
+                snapshot = IndexSnapshot.open(self.config, self.root, version)
+                if self.check is not None:
+                    self.check(snapshot)
+                if self.warm is not None:
+                    self.warm(snapshot)
+            except Exception:
+                self._failed_version = version
+                if snapshot is not None:
+                    snapshot.close()
+                raise
+            with self._swap_lock:
+                old, self.current = self.current, snapshot
+            old.retire()
+            print(f"Swapped in index snapshot {version} (was {old.version or 'the unversioned files'})")
+            return True
+
+    def watch(self, interval, stop=None):
+        """Reloads every `interval` seconds until `stop` (a threading.Event) is set"""
+        stop = stop or threading.Event()
+        while not stop.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"Could not load index snapshot {current_version(self.root)}, keeping "
+                      f"{self.current.version or 'the unversioned files'}: {e}")
+
+    def start_watcher(self, interval):
+        """Runs watch on a daemon thread; returns the Event that stops it"""
+        stop = threading.Event()
+        threading.Thread(target=self.watch, args=(interval, stop), name="snapshot-watcher", daemon=True).start()
+        return stop
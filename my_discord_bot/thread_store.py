@@ -0,0 +1,152 @@
+import queue
+import re
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+# SQLite's default limit on "?" parameters in one statement
+MAX_QUERY_PARAMS = 900
+
+# Too common to help a keyword search; BM25 would mostly ignore them anyway
+STOPWORDS = {
+    "a", "an", "and", "are", "can", "do", "does", "for", "from", "how", "i", "if", "in", "is", "it", "me", "my",
+    "of", "on", "or", "should", "so", "that", "the", "this", "to", "what", "when", "where", "which", "why", "with",
+    "you", "your",
+}
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 OR-query of quoted terms, or None if nothing is left"""
+    terms = [term for term in re.findall(r"\w+", text.lower()) if len(term) > 1 and term not in STOPWORDS]
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+
+
+class ThreadStore(object):
+    """
+    Read-only access to the threads table for the retrieval path.
+
+    Keeps a small pool of open connections so a question does not pay a
+    connect/close per thread, and can optionally hold the whole table in a
+    dict since the corpus is only a few thousand rows.
+    """
+
+    def __init__(self, db_path="data/threads.db", pool_size=4, in_memory=False):
+        self.db_path = db_path
+        self.uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        self._pool = queue.Queue()
+        for _ in range(max(1, pool_size)):
+            self._pool.put(self._connect())
+
+        self._rows = None
+        self._categories = None
+        if in_memory:
+            self._rows, self._categories = {}, {}
+            with self.connection() as conn:
+                for thread_id, header, content, category in conn.execute(
+                    "SELECT id, header, content, category FROM threads"
+                ):
+                    self._rows[thread_id] = (header, content)
+                    self._categories[thread_id] = category
+
+    def _connect(self):
+        # Connections are handed between executor threads, never shared at the same time
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def fetch(self, thread_ids):
+        """
+        Returns the threads for the given ids
+
+        Args:
+            thread_ids (List[str]): ids in rank order
+
+        Return:
+            List[Tuple[str, str]]: (header, content) in the same order, missing ids skipped
+        """
+        if self._rows is not None:
+            found = self._rows
+        else:
+            found = {}
+            unique_ids = list(dict.fromkeys(thread_ids))
+            with self.connection() as conn:
+                for start in range(0, len(unique_ids), MAX_QUERY_PARAMS):
+                    chunk = unique_ids[start:start + MAX_QUERY_PARAMS]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT id, header, content FROM threads WHERE id IN ({placeholders})", chunk
+                    )
+                    for thread_id, header, content in rows:
+                        found[thread_id] = (header, content)
+
+        return [found[thread_id] for thread_id in thread_ids if thread_id in found]
+
+    def categories(self, thread_ids):
+        """Category of each id, None for ids that are not in the table"""
+        if self._categories is not None:
+            found = self._categories
+        else:
+            unique_ids = list(dict.fromkeys(thread_ids))
+            with self.connection() as conn:
+                found = {}
+                for start in range(0, len(unique_ids), MAX_QUERY_PARAMS):
+                    chunk = unique_ids[start:start + MAX_QUERY_PARAMS]
+                    placeholders = ",".join("?" * len(chunk))
+                    found.update(conn.execute(f"SELECT id, category FROM threads WHERE id IN ({placeholders})", chunk))
+        return [found.get(thread_id) for thread_id in thread_ids]
+
+    def metadata(self):
+        """Thread id -> (source, category) for every thread, for partitioning the index"""
+        with self.connection() as conn:
+            return {thread_id: (source, category)
+                    for thread_id, source, category in conn.execute("SELECT id, source, category FROM threads")}
+
+    def ids(self):
+        """Every thread id, straight from the primary key index without touching any content"""
+        if self._rows is not None:
+            return set(self._rows)
+        with self.connection() as conn:
+            return {row[0] for row in conn.execute("SELECT id FROM threads")}
+
+    def search_lexical(self, text, limit=20):
+        """
+        BM25 keyword search over the threads_fts table load_data.py builds
+
+        Return:
+            List[Tuple[str, float]]: (thread id, score) best first, higher is better;
+            empty when there is nothing to search for or no FTS table yet
+        """
+        query = fts_query(text)
+        if query is None:
+            return []
+        with self.connection() as conn:
+            try:
+                rows = conn.execute(
+                    # Header matches count double; bm25() is lower-is-better, so negate it
+                    "SELECT id, -bm25(threads_fts, 0.0, 2.0, 1.0) AS score FROM threads_fts "
+                    "WHERE threads_fts MATCH ? ORDER BY score DESC LIMIT ?", (query, limit)
+                ).fetchall()
+            except sqlite3.OperationalError:  # no FTS table in this database
+                return []
+        return rows
+
+    def index_version(self):
+        """Version load_data.py recorded for the last re-index, None for older databases"""
+        with self.connection() as conn:
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+            except sqlite3.OperationalError:  # no meta table yet
+                return None
+        return row[0] if row else None
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
@@ -0,0 +1,193 @@
+import numpy as np
+
+# Vector search over the thread embeddings. Every backend takes a normalized
+# query vector and returns (scores, indices) for the top_k rows, best first,
+# where scores are cosine similarities (inner products of unit vectors).
+# The numpy and two_stage backends can also search a contiguous range of rows
+# (partition(start, stop)), which partitions.py uses to search by category.
+
+FAISS_INDEX_TYPES = ("flat", "ivf", "hnsw")
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ImportError:
+        raise ImportError("The faiss backend needs faiss installed: pip install faiss-cpu")
+    return faiss
+
+
+class NumpyIndex(object):
+    """
+    Exact search: one matrix-vector product and a partial sort.
+
+    float16 and int8 (with per-row scales) vectors are scored in blocks so a
+    memory-mapped store is never converted to float32 all at once.
+    """
+
+    block_rows = 4096
+
+    def __init__(self, embeddings, scales=None):
+        if embeddings.dtype not in (np.float32, np.float16, np.int8):
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.embeddings = embeddings
+        self.scales = scales
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def score(self, query_emb):
+        query = np.asarray(query_emb, dtype=np.float32).ravel()
+        if self.embeddings.dtype == np.float32:
+            return self.embeddings @ query
+
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = self.embeddings[start:start + self.block_rows].astype(np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def vectors(self, indices):
+        """float32 copies of the given rows, dequantized if needed"""
+        rows = np.asarray(self.embeddings[np.asarray(indices)], dtype=np.float32)
+        if self.scales is not None:
+            rows *= np.asarray(self.scales[np.asarray(indices)])[:, None]
+        return rows
+
+    def partition(self, start, stop):
+        """Index over rows start:stop, as views of the same (memory-mapped) arrays"""
+        return NumpyIndex(self.embeddings[start:stop], None if self.scales is None else self.scales[start:stop])
+
+    def search(self, query_emb, top_k):
+        scores = self.score(query_emb)
+        top_k = min(top_k, len(scores))
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return scores[order], order
+
+
+class TwoStageIndex(object):
+    """
+    Coarse-to-fine search: a cheap scan of a small copy of the vectors picks
+    `candidates` rows, then the full vectors rescore just those.
+
+    The small copy is the store's int8 copy or its PCA projection (see
+    embedding_store.write_store). Scores returned are the full vectors'
+    cosine similarities, so the relevance filters see the same scale as with
+    an exact search.
+    """
+
+    def __init__(self, full_index, coarse_index, projection=None, candidates=100):
+        self.full_index = full_index
+        self.coarse_index = coarse_index
+        self.projection = projection
+        self.candidates = candidates
+
+    def __len__(self):
+        return len(self.full_index)
+
+    def vectors(self, indices):
+        return self.full_index.vectors(indices)
+
+    def partition(self, start, stop):
+        return TwoStageIndex(self.full_index.partition(start, stop), self.coarse_index.partition(start, stop),
+                             projection=self.projection, candidates=self.candidates)
+
+    def search(self, query_emb, top_k):
+        query = np.asarray(query_emb, dtype=np.float32).ravel()
+        coarse_query = query @ self.projection if self.projection is not None else query
+        _, candidates = self.coarse_index.search(coarse_query, max(top_k, self.candidates))
+        scores = self.full_index.vectors(candidates) @ query
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return scores[order], candidates[order]
+
+
+class FaissIndex(object):
+    """Wraps an inner-product FAISS index (flat, IVF or HNSW)."""
+
+    def __init__(self, index, nprobe=None, ef_search=None):
+        faiss = _import_faiss()
+        if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            raise ValueError("FAISS index must use inner product; rebuild it with load_data.py")
+        if nprobe is not None and hasattr(index, "nprobe"):
+            index.nprobe = nprobe
+        if ef_search is not None and hasattr(index, "hnsw"):
+            index.hnsw.efSearch = ef_search
+        if hasattr(index, "make_direct_map"):
+            index.make_direct_map()  # IVF needs it for reconstruct()
+        self.index = index
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def vectors(self, indices):
+        return np.vstack([self.index.reconstruct(int(i)) for i in indices]) if len(indices) else np.zeros((0, self.index.d))
+
+    def search(self, query_emb, top_k):
+        query = np.asarray(query_emb, dtype=np.float32).reshape(1, -1)
+        scores, indices = self.index.search(query, min(top_k, self.index.ntotal))
+        keep = indices[0] >= 0  # IVF can come back short when few lists are probed
+        return scores[0][keep], indices[0][keep]
+
+
+def build_faiss_index(embeddings, index_type="flat", nlist=None, hnsw_m=32):
+    """
+    Builds an inner-product FAISS index over normalized embeddings
+
+    Args:
+        embeddings (np.ndarray): (N, D) normalized vectors
+        index_type (str): "flat" (exact), "ivf" or "hnsw"
+        nlist (int): IVF cluster count, defaults to about 4 * sqrt(N)
+        hnsw_m (int): HNSW graph degree
+
+    Return:
+        faiss.Index
+    """
+    faiss = _import_faiss()
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    dim = vectors.shape[1]
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "ivf":
+        nlist = nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}, expected one of {FAISS_INDEX_TYPES}")
+
+    index.add(vectors)
+    return index
+
+
+def save_faiss_index(index, path):
+    _import_faiss().write_index(index, path)
+
+
+def load_index(backend="numpy", embeddings_path="models/embeddings.npy", faiss_path="models/faiss_index.index",
+               nprobe=None, ef_search=None, store=None, candidates=100):
+    """Opens the configured backend over the artifacts written by load_data.py"""
+    if backend == "numpy":
+        if store is not None:
+            return NumpyIndex(store.vectors, scales=store.scales)
+        return NumpyIndex(np.load(embeddings_path))
+    if backend == "two_stage":
+        if store is None or store.coarse is None:
+            raise ValueError("The two_stage backend needs a store with a coarse copy; "
+                             "re-run load_data.py with EMBEDDING_STORE_COARSE=int8 or pca")
+        return TwoStageIndex(
+            NumpyIndex(store.vectors, scales=store.scales),
+            NumpyIndex(store.coarse, scales=store.coarse_scales),
+            projection=store.projection,
+            candidates=candidates,
+        )
+    if backend == "faiss":
+        return FaissIndex(_import_faiss().read_index(faiss_path), nprobe=nprobe, ef_search=ef_search)
+    raise ValueError(f"Unknown index backend {backend!r}, expected 'numpy', 'two_stage' or 'faiss'")
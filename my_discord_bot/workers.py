@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import pipeline
+
+# Supervisor mode: the Discord gateway runs in the bot process, and questions
+# are answered by worker processes, each question going to the least busy
+# one. Every worker memory-maps the same embedding store; the OS page cache
+# holds a single copy of the vectors however many workers there are.
+
+# How often the reader thread checks that every worker is still alive, in seconds
+LIVENESS_INTERVAL = 1.0
+
+
+def worker_main(jobs, results, threads):
+    """
+    Entry point of a worker process
+
+    Runs `threads` answering loops, each taking (job_id, question,
+    conversation, stream, sources) from `jobs` and putting (job_id, kind, value)
+    events on `results`. A None job stops one loop.
+    """
+    pipeline.warm_up()
+    pid = os.getpid()
+
+    def answer_loop():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            job_id, question, conversation, stream, sources = job
+            try:
+                for kind, value in pipeline.answer_events(question, conversation, stream, sources):
+                    results.put((job_id, kind, value))
+                results.put((job_id, "done", None))
+            except Exception as e:
+                results.put((job_id, "error", f"{type(e).__name__}: {e}"))
+            finally:
+                results.put((None, "metrics", pipeline.metrics.drain()))
+
+    loops = [threading.Thread(target=answer_loop, name=f"answer-{n}") for n in range(threads)]
+    for loop in loops:
+        loop.start()
+    results.put((None, "ready", pid))
+    for loop in loops:
+        loop.join()
+
+
+class Worker(object):
+    __slots__ = ("process", "jobs", "running")
+
+    def __init__(self, process, jobs):
+        self.process = process
+        self.jobs = jobs  # this worker's own job queue
+        self.running = set()  # job ids handed to it and not finished yet
+
+
+class WorkerPool(object):
+    """
+    Worker processes answering questions for the bot process.
+
+    answer() is an async generator of the same events pipeline.answer_events
+    yields. Each question goes to the worker with the fewest unfinished
+    questions. A reader thread routes events from the workers back to the
+    event loop of the question they belong to and merges the workers'
+    metrics into `metrics`. A worker that dies is replaced, and the
+    questions it held fail instead of waiting forever.
+    """
+
+    def __init__(self, processes, threads_per_process, metrics):
+        self.processes = processes
+        self.threads_per_process = threads_per_process
+        self.metrics = metrics
+        self._context = multiprocessing.get_context("spawn")  # no forking a process with a live event loop
+        self._results = self._context.Queue()
+        self._workers = []
+        self._ready = set()
+        self._streams = {}  # job id -> (event loop, asyncio.Queue)
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._reader = threading.Thread(target=self._read_results, name="worker-results", daemon=True)
+
+    def start(self):
+        for _ in range(self.processes):
+            self._spawn()
+        self._reader.start()
+
+    def _spawn(self):
+        jobs = self._context.Queue()
+        process = self._context.Process(
+            target=worker_main, args=(jobs, self._results, self.threads_per_process), daemon=True
+        )
+        process.start()
+        with self._lock:
+            self._workers.append(Worker(process, jobs))
+        print(f"Started worker process {process.pid}")
+
+    def alive(self):
+        return sum(worker.process.is_alive() for worker in self._workers)
+
+    def ready(self):
+        return len(self._ready)
+
+    async def answer(self, user_question, formatted_conversation, stream=True, sources=None):
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        job_id = next(self._job_ids)
+        with self._lock:
+            worker = min(self._workers, key=lambda worker: len(worker.running))
+            worker.running.add(job_id)
+            self._streams[job_id] = (loop, events)
+        worker.jobs.put((job_id, user_question, formatted_conversation, stream, sources))
+        try:
+            while True:
+                kind, value = await events.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise RuntimeError(f"Worker failed: {value}")
+                yield kind, value
+        finally:
+            with self._lock:
+                self._streams.pop(job_id, None)
+                worker.running.discard(job_id)
+
+    def _deliver(self, job_id, kind, value):
+        with self._lock:
+            target = self._streams.get(job_id)
+        if target is not None:
+            loop, events = target
+            loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+
+    def _read_results(self):
+        checked_at = time.monotonic()
+        while True:
+            # Checked on a timer rather than only when the queue is idle: under steady
+            # load the healthy workers' results never let it go quiet
+            if time.monotonic() - checked_at >= LIVENESS_INTERVAL:
+                self._replace_dead_workers()
+                checked_at = time.monotonic()
+            try:
+                job_id, kind, value = self._results.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                continue
+            if kind == "stop":
+                return
+            if kind == "metrics":
+                self.metrics.merge(value)
+            elif kind == "ready":
+                self._ready.add(value)
+            else:
+                self._deliver(job_id, kind, value)
+
+    def _replace_dead_workers(self):
+        if self._stopping:
+            return
+        for worker in [worker for worker in self._workers if not worker.process.is_alive()]:
+            pid = worker.process.pid
+            print(f"Worker process {pid} exited with code {worker.process.exitcode}; replacing it")
+            self.metrics.count("worker_restarts")
+            with self._lock:
+                self._workers.remove(worker)
+                lost = list(worker.running)
+            self._ready.discard(pid)
+            for job_id in lost:
+                self._deliver(job_id, "error", f"worker process {pid} died")
+            self._spawn()
+
+    def stop(self, timeout=10.0):
+        self._stopping = True
+        for worker in self._workers:
+            for _ in range(self.threads_per_process):
+                worker.jobs.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._results.put((None, "stop", None))
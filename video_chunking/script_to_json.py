@@ -1,90 +1,236 @@
-import re
+"""
+Chunks course video transcripts into the {id, header, content, category, source}
+items the bot indexes.
+
+Every .txt file in a directory is chunked in parallel, either at narrative
+break phrases (the way the scripts in scripts_json_format/ were made) or into
+token-sized windows that overlap, with settings per file from a JSON config:
+
+    {
+      "defaults": {"source": "course", "chunk_tokens": 400, "overlap_tokens": 50},
+      "files": {
+        "Autods script.txt": {"category": "autods", "header": "autods", "id_prefix": "autods",
+                              "break_patterns": ["So if you have", "Right now"]}
+      }
+    }
+
+Ids are "<id_prefix>-<n>", the prefix defaulting to the file name, so chunks
+from different chapters never collide. Either write one JSON file per
+transcript, or a single JSONL stream (use - for stdout):
+    python video_chunking/script_to_json.py transcripts/ --config video_chunking/chunk_config.json --output-dir scripts_json_format
+    python video_chunking/script_to_json.py transcripts/ --jsonl -
+
+load_data.py --transcripts <dir> chunks the same way and embeds the chunks
+directly, without any intermediate files.
+"""
+import argparse
 import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-# File path
-file_path = "/Users/williamkapner/Downloads/Autods script.txt"
-output_path = "script_autods.json"
+DEFAULTS = {
+    "category": None,  # file name when not set
+    "source": "course",
+    "header": None,  # file name when not set and there is no header_pattern
+    "header_pattern": None,  # regex matching a whole line that starts a new section, e.g. "Part \\d+ - .+"
+    "break_patterns": [],  # phrases (regex) a new chunk starts at
+    "chunk_tokens": 400,  # size of token windows, and most a break-pattern chunk may grow to
+    "overlap_tokens": 50,  # tokens the next window repeats from the end of the previous one
+    "min_chars": 150,  # shorter fragments are dropped, as before
+    "id_prefix": None,  # file name when not set
+}
 
-def preprocess_script(text):
-    text = re.sub(r'\r\n?', '\n', text)  # Normalize line endings
-    text = re.sub(r'\n{3,}', '\n\n', text.strip())  # Collapse excessive blank lines
-    return text
 
+def estimate_tokens(text):
+    """Rough token count, the same four-characters-per-token estimate the bot uses"""
+    return len(text) // 4 + 1
 
-import re
 
-def chunk_script(text):
-    chunks = []
-    chunk_id = 1
-    current_header = "autods"
+def slug(name):
+    return re.sub(r"[^a-z0-9]+", "_", os.path.splitext(name)[0].lower()).strip("_")
 
-    # Normalize line endings and spacing
-    text = re.sub(r'\r\n?', '\n', text).strip()
-    text = re.sub(r'\n{3,}', '\n\n', text)  # collapse excessive blank lines
 
-    # Define breakpoints using common narrative transitions
-    break_pattern = re.compile(
-        r'(?=\b(?:So if you have|To demonstrate this|Right now|So AutoDS|Now when I|The customer paid|But enough talking|Coming into shopify|Coming back to autods|Which is exactly why)\b)',
-        flags=re.IGNORECASE
-    )
+def load_config(path):
+    """Settings per file name, merged over the defaults"""
+    config = {"defaults": {}, "files": {}}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    return config
+
 
-    blocks = re.split(break_pattern, text)
-    for block in blocks:
-        clean_block = block.strip()
-        if len(clean_block) < 150:  # avoid tiny fragments
-            continue
-
-        chunks.append({
-            "id": chunk_id,
-            "header": current_header,
-            "content": clean_block,
-            "category": "autods",
-            "source": "course"
-        })
-        chunk_id += 1
+def settings_for(config, file_name):
+    settings = dict(DEFAULTS)
+    settings.update(config.get("defaults", {}))
+    settings.update(config.get("files", {}).get(file_name, {}))
+    stem = os.path.splitext(file_name)[0]
+    settings["category"] = settings["category"] or stem
+    settings["header"] = settings["header"] or stem
+    settings["id_prefix"] = settings["id_prefix"] or slug(file_name)
+    return settings
 
+
+def preprocess_script(text):
+    text = re.sub(r'\r\n?', '\n', text)  # Normalize line endings
+    text = re.sub(r'\n{3,}', '\n\n', text.strip())  # Collapse excessive blank lines
+    return text
+
+
+def split_sections(text, header_pattern, default_header):
+    """(header, text) per section; everything is one section without a header_pattern"""
+    if not header_pattern:
+        return [(default_header, text)]
+    sections = []
+    header, lines = default_header, []
+    matcher = re.compile(header_pattern)
+    for line in text.split("\n"):
+        if matcher.fullmatch(line.strip()):
+            if "".join(lines).strip():
+                sections.append((header, "\n".join(lines).strip()))
+            header, lines = line.strip(), []
+        else:
+            lines.append(line)
+    if "".join(lines).strip():
+        sections.append((header, "\n".join(lines).strip()))
+    return sections
+
+
+def split_sentences(text):
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+
+
+def token_windows(text, chunk_tokens, overlap_tokens):
+    """
+    Splits text into windows of whole sentences of about chunk_tokens each
+
+    Each window after the first starts with the last overlap_tokens worth of
+    sentences of the one before, so an idea cut at a boundary is still whole
+    in one of the two.
+    """
+    sentences = split_sentences(text)
+    windows, start = [], 0
+    while start < len(sentences):
+        end, used = start, 0
+        while end < len(sentences) and (end == start or used + estimate_tokens(sentences[end]) <= chunk_tokens):
+            used += estimate_tokens(sentences[end])
+            end += 1
+        windows.append(" ".join(sentence.strip() for sentence in sentences[start:end]))
+        if end == len(sentences):
+            break
+        # Step back over the sentences to repeat, but always move forward
+        next_start, repeated = end, 0
+        while next_start - 1 > start and repeated + estimate_tokens(sentences[next_start - 1]) <= overlap_tokens:
+            next_start -= 1
+            repeated += estimate_tokens(sentences[next_start])
+        start = next_start
+    return windows
+
+
+def break_blocks(text, break_patterns):
+    """Splits text in front of each narrative break phrase"""
+    break_pattern = re.compile(r'(?=\b(?:' + "|".join(break_patterns) + r')\b)', flags=re.IGNORECASE)
+    return re.split(break_pattern, text)
+
+
+def chunk_text(text, settings):
+    """
+    Chunks one transcript
+
+    Return:
+        List[dict]: items in transcript order, with ids <id_prefix>-001, -002, ...
+    """
+    chunks = []
+    for header, section in split_sections(preprocess_script(text), settings["header_pattern"], settings["header"]):
+        if settings["break_patterns"]:
+            blocks = []
+            for block in break_blocks(section, settings["break_patterns"]):
+                if estimate_tokens(block) > settings["chunk_tokens"]:
+                    blocks.extend(token_windows(block, settings["chunk_tokens"], settings["overlap_tokens"]))
+                else:
+                    blocks.append(block)
+        else:
+            blocks = token_windows(section, settings["chunk_tokens"], settings["overlap_tokens"])
+
+        for block in blocks:
+            clean_block = block.strip()
+            if len(clean_block) < settings["min_chars"]:  # avoid tiny fragments
+                continue
+            chunks.append({
+                "id": f"{settings['id_prefix']}-{len(chunks) + 1:03d}",
+                "header": header,
+                "content": clean_block,
+                "category": settings["category"],
+                "source": settings["source"],
+            })
     return chunks
 
 
+def chunk_file(path, settings):
+    with open(path, "r", encoding="utf-8") as f:
+        return chunk_text(f.read(), settings)
 
 
+def transcript_paths(input_dir):
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if name.endswith(".txt") and os.path.isfile(os.path.join(input_dir, name))
+    )
 
 
+def chunk_directory(input_dir, config, workers=None):
+    """
+    Chunks every transcript in input_dir on a process pool
 
+    Yields (path, chunks) per file in name order as soon as that file is done,
+    so callers can stream the chunks on without waiting for the whole directory.
+    """
+    paths = transcript_paths(input_dir)
+    settings = [settings_for(config, os.path.basename(path)) for path in paths]
+    prefixes = {}
+    for path, file_settings in zip(paths, settings):
+        other = prefixes.setdefault(file_settings["id_prefix"], path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would both use id prefix {file_settings['id_prefix']!r}")
 
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from zip(paths, pool.map(chunk_file, paths, settings))
 
-# Step 3: Format chunks into the required structure
-def format_chunks(chunked, category="autods", source="course"):
-    formatted_chunks = []
-    for i, chunk in enumerate(chunked, start=1):
-        formatted_chunk = {
-            "id": i,
-            "header": chunk["header"],
-            "content": chunk["content"],
-            "category": category,
-            "source": source
-        }
-        formatted_chunks.append(formatted_chunk)
-    return formatted_chunks
 
-# Step 4: Save to JSON
 def save_to_json(chunks, path):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(chunks, f, indent=2, ensure_ascii=False)
-    print(f"✅ Saved {len(chunks)} chunks to {path}")
-
-# Step 5: Preview
-def print_sample_chunks(chunks, n=5):
-    for chunk in chunks[:n]:
-        print(json.dumps(chunk, indent=2))
-        print("-" * 50)
-
-# -------- Main Execution --------
-with open(file_path, "r", encoding="utf-8") as f:
-    raw_text = f.read()
-
-processed_text = preprocess_script(raw_text)
-chunked = chunk_script(processed_text)
-formatted_chunks = format_chunks(chunked)
-save_to_json(formatted_chunks, output_path)
-print_sample_chunks(formatted_chunks)
+    print(f"✅ Saved {len(chunks)} chunks to {path}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", help="directory of .txt transcripts")
+    parser.add_argument("--config", help="JSON file with defaults and per-file settings")
+    parser.add_argument("--output-dir", help="write script_<name>.json per transcript here")
+    parser.add_argument("--jsonl", help="write all chunks to this JSONL file, - for stdout")
+    parser.add_argument("--workers", type=int, default=None, help="processes; defaults to the CPU count")
+    args = parser.parse_args()
+    if not (args.output_dir or args.jsonl):
+        parser.error("give --output-dir and/or --jsonl")
+
+    config = load_config(args.config)
+    stream = None
+    if args.jsonl:
+        stream = sys.stdout if args.jsonl == "-" else open(args.jsonl, "w", encoding="utf-8")
+    try:
+        for path, chunks in chunk_directory(args.input_dir, config, workers=args.workers):
+            if args.output_dir:
+                save_to_json(chunks, os.path.join(args.output_dir, f"script_{slug(os.path.basename(path))}.json"))
+            if stream is not None:
+                for chunk in chunks:
+                    stream.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                stream.flush()
+    finally:
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+
+
+if __name__ == "__main__":
+    main()